@@ -1,46 +1,332 @@
+import time
+_module_import_started = time.perf_counter()  # 启动耗时报告的计时起点
+
+_import_marks = []  # (分组名, 该组导入完成时刻)，用于拆分模块导入耗时
+
 import logging
-from logging.handlers import RotatingFileHandler
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from typing import List, Optional, Dict, Any, Tuple, Callable
+from datetime import date, datetime, timedelta, timezone
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+import asyncio
+import threading
+import importlib
+import queue
+import atexit
+import contextvars
+import hmac
+import inspect
+import uuid
+import socket
+import re
+import sys
+import os
+import json
+import hashlib
+import gzip
+import csv
+import io
+_import_marks.append(("stdlib", time.perf_counter()))
+
 from pydantic import BaseModel
+_import_marks.append(("pydantic", time.perf_counter()))
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Response, Query
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.concurrency import run_in_threadpool
-
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool as _run_in_threadpool
+import fastapi.concurrency
+import fastapi.routing
+import fastapi.dependencies.utils
+_import_marks.append(("fastapi", time.perf_counter()))
+
+from sqlalchemy import create_engine, event, func, text, Column, Integer, String, Float, DateTime, Boolean, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex
+_import_marks.append(("sqlalchemy", time.perf_counter()))
 
-from dotenv import load_dotenv
-import akshare as ak
-import pandas as pd
-from tenacity import retry, stop_after_attempt, wait_exponential, before_log, wait_fixed
+import requests
+from requests.adapters import HTTPAdapter
+_import_marks.append(("requests", time.perf_counter()))
 
-import asyncio
+from dotenv import load_dotenv
+from tenacity import Retrying, stop_after_attempt, wait_random_exponential
 import schedule
-import time
-import threading
-import os
+_import_marks.append(("dotenv/tenacity/schedule", time.perf_counter()))
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时回退到标准库 json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，缺失时只提供 gzip 压缩
+    brotli = None
+_import_marks.append(("orjson/brotli", time.perf_counter()))
+
+def _import_breakdown() -> Dict[str, float]:
+    breakdown, previous = {}, _module_import_started
+    for group, finished in _import_marks:
+        breakdown[group] = round(finished - previous, 4)
+        previous = finished
+    return breakdown
+
+# 启动耗时报告：模块导入（按依赖分组）、各初始化阶段以及延迟导入的 provider 库分别计时
+startup_report: Dict[str, Any] = {
+    "imports_seconds": round(time.perf_counter() - _module_import_started, 4),
+    "imports": _import_breakdown(),
+    "phases": {},
+    "lazy_imports": {},
+    "module_ready_seconds": None,
+    "startup_complete_seconds": None,
+}
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_report["phases"][name] = round(time.perf_counter() - started, 4)
+
+class LazyModule:
+    """首次访问属性时才导入的模块代理，akshare/pandas 不再拖慢启动"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    startup_report["lazy_imports"][self._name] = {
+                        "seconds": round(time.perf_counter() - started, 4),
+                        "loaded_by": threading.current_thread().name,
+                    }
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, item):
+        return getattr(self.load(), item)
+
+ak = LazyModule("akshare")
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
 
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,  # 改为WARNING级别，减少日志输出
-    format='%(asctime)s - %(levelname)s - %(filename)s - %(lineno)d - %(message)s',
-    # 限制日志文件大小
-    handlers=[
-        RotatingFileHandler('logs/backend.log', maxBytes=10*1024*1024, backupCount=5),  # 文件输出
-        # Removed logging.StreamHandler() to prevent console output
-    ]
-)
+# LOG_ASYNC=1（默认）时业务线程只把记录放入内存队列，由后台 QueueListener 线程写文件；
+# LOG_FORMAT=json 输出每行一个 JSON 对象，extra 中的字段原样写入
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") == "1"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 5))              # 每个 sample_key 每个窗口内最多输出的条数
+LOG_SAMPLE_WINDOW_SECONDS = float(os.getenv("LOG_SAMPLE_WINDOW_SECONDS", 60))
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        payload.update({k: v for k, v in vars(record).items() if k not in _LOG_RECORD_ATTRS})
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class LogSamplingFilter(logging.Filter):
+    """带 extra={"sample_key": ...} 的重复性日志（如逐只股票的失败信息）按 key 限流：
+    每个窗口内只输出前 LOG_SAMPLE_BURST 条，被丢弃的条数记在下一条输出记录的 suppressed 字段里"""
+
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._windows: Dict[str, List] = {}  # key -> [窗口开始时间, 已输出条数, 已丢弃条数]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample_key", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                state = self._windows[key] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if state[1] >= self.burst:
+                state[2] += 1
+                return False
+            state[1] += 1
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg}（上一窗口省略了 {suppressed} 条同类日志）"
+        return True
+
+def configure_logging() -> Optional[QueueListener]:
+    file_handler = RotatingFileHandler('logs/backend.log', maxBytes=10*1024*1024, backupCount=5)  # 文件输出
+    if LOG_FORMAT == "json":
+        file_handler.setFormatter(JsonLogFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(levelname)s - %(filename)s - %(lineno)d - %(message)s'))
+    sampling = LogSamplingFilter(LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW_SECONDS)
+    listener = None
+    if LOG_ASYNC:
+        handler = QueueHandler(queue.SimpleQueue())
+        handler.setFormatter(logging.Formatter("%(message)s"))  # 入队前只合并消息与异常堆栈，完整格式由文件 handler 负责
+        listener = QueueListener(handler.queue, file_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)  # 退出前写完队列中剩余的记录
+    else:
+        handler = file_handler
+    handler.addFilter(sampling)
+    # 限制日志文件大小；不输出到控制台
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+    return listener
+
+_logging_started = time.perf_counter()
+log_listener = configure_logging()
+startup_report["phases"]["logging"] = round(time.perf_counter() - _logging_started, 4)
+
+# 多 worker 部署时用于区分进程，任务状态与调度租约都记录该标识
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+JOB_STATUS_FLUSH_INTERVAL = float(os.getenv("JOB_STATUS_FLUSH_INTERVAL", 1))
+
+class JobStatusWriter:
+    """后台线程把任务状态写入 job_status 表。调用方（多在事件循环线程上）只把最新状态放入待写字典，
+    不等待 SQLite 写锁；同一任务尚未写出的旧状态直接被新状态覆盖"""
+
+    def __init__(self):
+        self._pending: Dict[str, Tuple[str, float]] = {}
+        self._cond = threading.Condition()
+        self._writing = False
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, name: str, payload: str):
+        with self._cond:
+            self._pending[name] = (payload, time.time())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="job-status-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                pending, self._pending = self._pending, {}
+                self._writing = True
+            try:
+                self._write(pending)
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _write(pending: Dict[str, Tuple[str, float]]):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "INSERT INTO job_status (name, payload, worker, updated_at) VALUES (:name, :payload, :worker, :updated_at) "
+                    "ON CONFLICT(name) DO UPDATE SET payload = excluded.payload, worker = excluded.worker, "
+                    "updated_at = excluded.updated_at"),
+                    [{"name": name, "payload": payload, "worker": WORKER_ID, "updated_at": updated_at}
+                     for name, (payload, updated_at) in pending.items()])
+        except Exception as e:
+            logging.warning(f"同步任务状态 {', '.join(pending)} 失败: {e}")
+
+    def drain(self, timeout: float = 5.0) -> bool:
+        """等待待写状态全部落库，进程退出前调用"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+job_status_writer = JobStatusWriter()
+atexit.register(job_status_writer.drain)
+
+class SharedJobStatus(dict):
+    """任务进度，写入时（按间隔节流）经后台线程同步到 SQLite job_status 表，任意 worker 都能读到同一份进度"""
+
+    def __init__(self, name: str, initial: Dict[str, Any]):
+        super().__init__(initial)
+        self.name = name
+        self._last_flush = 0.0
+
+    def __setitem__(self, key, value):
+        status_changed = key == "status" and self.get("status") != value
+        super().__setitem__(key, value)
+        # 状态切换、开始/结束进度立即落库，其余进度更新按间隔节流，避免逐行写库
+        if (status_changed or (key == "progress" and value in (0, 99, 100, -1))
+                or time.monotonic() - self._last_flush >= JOB_STATUS_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        job_status_writer.submit(self.name, json.dumps(dict(self), ensure_ascii=False, default=str))
+
+def _idle_job_status(name: str) -> SharedJobStatus:
+    return SharedJobStatus(name, {"status": "空闲", "message": "未开始", "progress": 0})
 
 full_market_update_status = {
-    "A股": {"status": "空闲", "message": "未开始", "progress": 0},
-    "H股": {"status": "空闲", "message": "未开始", "progress": 0},
-    "美股": {"status": "空闲", "message": "未开始", "progress": 0},
-    "overall": {"status": "空闲", "message": "未开始", "progress": 0}
+    "A股": _idle_job_status("A股"),
+    "H股": _idle_job_status("H股"),
+    "美股": _idle_job_status("美股"),
+    "overall": _idle_job_status("overall")
 }
 
+# 自选股行情/基本面等后台任务的进度，与全市场更新状态分开返回，避免影响前端的全市场轮询逻辑
+background_job_status = {
+    "watchlist_quotes": _idle_job_status("watchlist_quotes"),
+}
+
+def read_shared_job_status(registry: Optional[Dict[str, SharedJobStatus]] = None) -> Dict[str, Any]:
+    """从 job_status 表读取所有 worker 共享的任务状态，表中没有记录的任务返回本进程的默认值"""
+    registry = full_market_update_status if registry is None else registry
+    names = list(registry)
+    result = {name: dict(registry[name]) for name in names}
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT name, payload, worker, updated_at FROM job_status")).fetchall()
+    except Exception as e:
+        logging.warning(f"读取共享任务状态失败，返回本进程状态: {e}")
+        return result
+    for name, payload, worker, updated_at in rows:
+        if name in names:
+            # 本进程写出的记录可能还落后于尚在写入队列中的最新状态，直接使用内存中的值
+            state = result[name] if worker == WORKER_ID else json.loads(payload)
+            result[name] = {**state, "worker": worker,
+                            "updated_at": datetime.fromtimestamp(updated_at, timezone.utc).isoformat()}
+    return result
+
 BATCH_SIZE = 100
 
 load_dotenv()
@@ -72,7 +358,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Total-Count"], # 暴露 X-Total-Count 头部
+    expose_headers=["X-Total-Count", "ETag", "X-Cache", "X-Data-Version", "X-Profile-Id", "Server-Timing"], # 暴露 X-Total-Count / 缓存 / 剖析相关头部
 )
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./stock_valuation.db"
@@ -111,6 +397,7 @@ class Stock(Base):
     auto_update = Column(Boolean, default=True)
     calculated_pe_mid = Column(Float)
     theoretical_price_mid = Column(Float)
+    row_version = Column(Integer, index=True)  # 每次写入从全局序列分配，供 /stock_api/changes 增量同步
 
 class WholeMarketStock(Base):
     __tablename__ = "whole_market_stocks"
@@ -122,8 +409,88 @@ class WholeMarketStock(Base):
     change_percent = Column(Float)
     last_updated = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     is_watchlist = Column(Boolean, default=False)
-
-Base.metadata.create_all(bind=engine)
+    # 批量基本面：由 update_whole_market_fundamentals 按市场整体写入并统一重新估值
+    book_value_per_share = Column(Float)
+    eps = Column(Float)
+    roe = Column(Float)
+    current_pe = Column(Float)
+    market_cap = Column(Float)
+    calculated_pe_lower = Column(Float)
+    calculated_pe_mid = Column(Float)
+    calculated_pe_upper = Column(Float)
+    theoretical_price_lower = Column(Float)
+    theoretical_price_mid = Column(Float)
+    theoretical_price_upper = Column(Float)
+    valuation_status = Column(String)
+    fundamentals_updated = Column(DateTime)
+    row_version = Column(Integer, index=True)
+    missing_since = Column(DateTime)  # 最近一次全量行情中不存在该股票的起始时间
+
+class JobStatus(Base):
+    __tablename__ = "job_status"
+    name = Column(String, primary_key=True)
+    payload = Column(Text, nullable=False)
+    worker = Column(String)
+    updated_at = Column(Float)
+
+class SchedulerLease(Base):
+    __tablename__ = "scheduler_leases"
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(Float, nullable=False)
+
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+    key = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class AlertRule(Base):
+    __tablename__ = "alert_rules"
+    id = Column(Integer, primary_key=True, index=True)
+    symbol = Column(String, index=True, nullable=False)
+    market = Column(String, nullable=False)
+    kind = Column(String, nullable=False)
+    threshold = Column(Float)
+    enabled = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class DeletedRow(Base):
+    """stocks / whole_market_stocks 被删除行的墓碑记录，增量同步时告知客户端删除本地副本"""
+    __tablename__ = "deleted_rows"
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String, nullable=False, index=True)
+    row_id = Column(Integer, nullable=False)
+    symbol = Column(String)
+    market = Column(String)
+    row_version = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+def migrate_added_columns():
+    """create_all 不会给已存在的表补列：比对模型与库中的列，缺少的列用 ALTER TABLE ADD COLUMN 补上，并补建其索引"""
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table.name})"))}
+            added = [column for column in table.columns if column.name not in existing]
+            for column in added:
+                column_type = column.type.compile(dialect=engine.dialect)
+                try:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                except OperationalError as e:
+                    # 多个 worker 同时启动时可能都判断该列缺失，后执行的一方遇到重复列直接跳过
+                    if "duplicate column name" not in str(e):
+                        raise
+                    continue
+                logging.info(f"数据表 {table.name} 新增列 {column.name} {column_type}")
+            for index in table.indexes:
+                if any(column.name in index.columns for column in added):
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+
+def init_database():
+    # 建表放到 startup 阶段执行，import app 本身不再触碰数据库
+    with startup_phase("create_all"):
+        Base.metadata.create_all(bind=engine)
+        migrate_added_columns()
+        init_row_versions()
 
 # Pydantic Models
 class StockBase(BaseModel):
@@ -174,6 +541,18 @@ class WholeMarketStockBase(BaseModel):
     change_percent: Optional[float] = None
     last_updated: Optional[datetime] = None
     is_watchlist: bool = False
+    book_value_per_share: Optional[float] = None
+    eps: Optional[float] = None
+    roe: Optional[float] = None
+    current_pe: Optional[float] = None
+    market_cap: Optional[float] = None
+    calculated_pe_lower: Optional[float] = None
+    calculated_pe_mid: Optional[float] = None
+    calculated_pe_upper: Optional[float] = None
+    theoretical_price_lower: Optional[float] = None
+    theoretical_price_mid: Optional[float] = None
+    theoretical_price_upper: Optional[float] = None
+    valuation_status: Optional[str] = None
 
 class WholeMarketStockResponse(WholeMarketStockBase):
     id: int
@@ -209,6 +588,20 @@ class WatchlistUpdatePayload(BaseModel):
     market: str
     is_watchlist: bool
 
+class AlertRuleCreate(BaseModel):
+    symbol: str
+    market: str
+    kind: str
+    threshold: Optional[float] = None
+
+class AlertRuleResponse(AlertRuleCreate):
+    id: int
+    enabled: bool = True
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -217,6 +610,438 @@ def get_db():
     finally:
         db.close()
 
+# 请求剖析：管理员通过 X-Profile: 1 请求头或 ?profile=1 开启（需携带 ADMIN_TOKEN），
+# 超过 PROFILE_SLOW_MS 的请求自动记录。分项统计 SQL、Pydantic 校验、序列化、压缩和线程池排队耗时，
+# 并对执行过的 SELECT 语句给出 EXPLAIN QUERY PLAN，最近的记录保存在内存环形缓冲区中
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 1000))  # 0 表示关闭慢请求自动记录
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", 50))
+PROFILE_MAX_STATEMENTS = 200
+PROFILE_SECTIONS = ("sql", "validation", "serialization", "compression", "threadpool_wait")
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, query: str, requested: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.query = query
+        self.requested = requested
+        self.started = time.perf_counter()
+        self.timings = {section: 0.0 for section in PROFILE_SECTIONS}
+        self.counts = {section: 0 for section in PROFILE_SECTIONS}
+        self.statements: List[Dict[str, Any]] = []
+        self.status_code: Optional[int] = None
+        self.response_seconds: Optional[float] = None
+
+    def add(self, section: str, seconds: float):
+        # 线程池中的函数与事件循环共享同一个 profile 对象，浮点累加在 GIL 下足够准确
+        self.timings[section] += seconds
+        self.counts[section] += 1
+
+    def server_timing(self) -> str:
+        parts = [f"{section.replace('_', '-')};dur={self.timings[section] * 1000:.2f}" for section in PROFILE_SECTIONS]
+        return ", ".join(parts + [f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "trigger": "requested" if self.requested else "slow",
+            "status_code": self.status_code,
+            "total_ms": round(self.response_seconds * 1000, 3) if self.response_seconds is not None else None,
+            "breakdown_ms": {section: round(seconds * 1000, 3) for section, seconds in self.timings.items()},
+            "counts": self.counts,
+            "statements": self.statements,
+        }
+
+_current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("request_profile", default=None)
+profile_buffer: deque = deque(maxlen=PROFILE_BUFFER_SIZE)
+
+@contextmanager
+def profile_section(section: str):
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(section, time.perf_counter() - started)
+
+async def run_in_threadpool(func: Callable, *args, **kwargs):
+    """fastapi.concurrency.run_in_threadpool 的包装：剖析时记录从提交到线程真正开始执行的排队时间。
+    下方同时替换了 FastAPI 内部引用的 run_in_threadpool，同步依赖（如 get_db）和 def 接口的排队也计入；
+    yield 依赖退出阶段由 FastAPI 直接调用 anyio，不经过这里，不计入"""
+    profile = _current_profile.get()
+    if profile is None:
+        return await _run_in_threadpool(func, *args, **kwargs)
+    submitted = time.perf_counter()
+
+    def call():
+        profile.add("threadpool_wait", time.perf_counter() - submitted)
+        return func(*args, **kwargs)
+    return await _run_in_threadpool(call)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _profile_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _profile_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is None or not conn.info.get("profile_started"):
+        return
+    elapsed = time.perf_counter() - conn.info["profile_started"].pop()
+    profile.add("sql", elapsed)
+    if len(profile.statements) < PROFILE_MAX_STATEMENTS:
+        profile.statements.append({"sql": statement, "parameters": None if executemany else parameters,
+                                   "executemany": executemany, "ms": round(elapsed * 1000, 3)})
+
+def _warn_patch_missing(module, name: str, section: str):
+    # 按 fastapi==0.104.1 编写，升级后内部函数改名或移动时对应的剖析分项会一直为 0，启动时提示一次
+    logging.warning(f"请求剖析无法挂载 {module.__name__}.{name}（FastAPI {fastapi.__version__}），"
+                    f"{section} 分项将不再计时")
+
+def _patch_timed(module, name: str, section: str):
+    """给 FastAPI 内部的校验函数计时；FastAPI 版本变化导致函数不存在时跳过并记录警告"""
+    original = getattr(module, name, None)
+    if original is None:
+        _warn_patch_missing(module, name, section)
+        return
+    if inspect.iscoroutinefunction(original):
+        async def timed(*args, **kwargs):
+            with profile_section(section):
+                return await original(*args, **kwargs)
+    else:
+        def timed(*args, **kwargs):
+            with profile_section(section):
+                return original(*args, **kwargs)
+    setattr(module, name, timed)
+
+# 请求体/查询参数校验与 response_model 校验
+_patch_timed(fastapi.dependencies.utils, "request_body_to_args", "validation")
+_patch_timed(fastapi.dependencies.utils, "request_params_to_args", "validation")
+_patch_timed(fastapi.routing, "serialize_response", "validation")
+
+# FastAPI 通过各自模块内导入的 run_in_threadpool 执行同步依赖、def 接口和 yield 依赖的进入阶段
+for _module in (fastapi.concurrency, fastapi.routing, fastapi.dependencies.utils):
+    if getattr(_module, "run_in_threadpool", None) is _run_in_threadpool:
+        _module.run_in_threadpool = run_in_threadpool
+    else:
+        _warn_patch_missing(_module, "run_in_threadpool", "threadpool_wait")
+
+def explain_statements(statements: List[Dict[str, Any]]) -> None:
+    """对记录的 SELECT 语句补充执行计划，相同语句只解释一次"""
+    plans: Dict[str, List[str]] = {}
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for entry in statements:
+            sql = entry["sql"]
+            if not sql.lstrip().upper().startswith("SELECT") or entry["executemany"]:
+                continue
+            if sql not in plans:
+                try:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", entry["parameters"] or ())
+                    plans[sql] = [row[-1] for row in cursor.fetchall()]
+                except Exception as e:
+                    plans[sql] = [f"无法解释: {e}"]
+            entry["query_plan"] = plans[sql]
+    finally:
+        raw.close()
+
+def is_admin(request: Request) -> bool:
+    # 只接受请求头：查询参数会出现在 uvicorn 访问日志和代理日志中
+    token = request.headers.get("x-admin-token") or ""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def require_admin(request: Request):
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+
+class ProfilingMiddleware:
+    """纯 ASGI 中间件：在请求所在的 context 中放入 RequestProfile，响应发送完成后再解释 SQL 并存档，不增加客户端延迟"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        requested = (request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1")
+        if requested and not is_admin(request):
+            response = Response(content=dumps_json({"detail": "请求剖析需要管理员权限"}), status_code=403,
+                                media_type="application/json")
+            return await response(scope, receive, send)
+        if not requested and PROFILE_SLOW_MS <= 0:
+            return await self.app(scope, receive, send)
+
+        # 令牌不再从查询参数读取，但客户端误传时也不写入剖析记录
+        query = re.sub(r"(^|&)admin_token=[^&]*", "", scope.get("query_string", b"").decode("latin-1")).lstrip("&")
+        profile = RequestProfile(scope["method"], scope["path"], query, requested)
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                profile.response_seconds = time.perf_counter() - profile.started
+                if requested:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-profile-id", profile.id.encode()), (b"server-timing", profile.server_timing().encode())]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _current_profile.reset(token)
+        if profile.response_seconds is None:
+            return
+        if requested or profile.response_seconds * 1000 >= PROFILE_SLOW_MS:
+            await _run_in_threadpool(explain_statements, profile.statements)
+            profile_buffer.append(profile)
+            if not requested:
+                logging.warning(f"慢请求 {profile.method} {profile.path}?{profile.query} 耗时 "
+                                f"{profile.response_seconds * 1000:.1f}ms，剖析记录 {profile.id}",
+                                extra={"sample_key": "slow_request", "profile": profile.to_dict()["breakdown_ms"]})
+
+app.add_middleware(ProfilingMiddleware)
+
+# 数据版本号：每个写路径按 表/市场 递增，列表类接口的响应缓存以此失效。
+# 版本号同时写入 data_versions 表，后台线程每 DATA_VERSION_SYNC_SECONDS 同步一次，其他 worker 的写入最多延迟这么久可见。
+# 读取只访问内存，异步接口在事件循环上取版本号不会触发查询
+VERSIONED_TABLES = ("stocks", "whole_market_stocks")
+DATA_VERSION_SYNC_SECONDS = float(os.getenv("DATA_VERSION_SYNC_SECONDS", 1))
+data_versions: Dict[str, int] = {}
+_data_versions_lock = threading.Lock()
+
+def bump_data_version(table: str, market: Optional[str] = None):
+    key = f"{table}:{market}" if market else f"{table}:*"
+    with _data_versions_lock:
+        data_versions[key] = data_versions.get(key, 0) + 1
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO data_versions (key, version) VALUES (:key, 1) "
+                              "ON CONFLICT(key) DO UPDATE SET version = version + 1"), {"key": key})
+    except Exception as e:
+        logging.warning(f"写入共享数据版本 {key} 失败: {e}")
+
+def _sync_data_versions():
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT key, version FROM data_versions")).fetchall()
+    except Exception as e:
+        logging.warning(f"同步共享数据版本失败: {e}")
+        return
+    with _data_versions_lock:
+        for key, version in rows:
+            data_versions[key] = max(data_versions.get(key, 0), version)
+
+def run_data_version_sync():
+    while True:
+        time.sleep(DATA_VERSION_SYNC_SECONDS)
+        _sync_data_versions()
+
+def get_data_version(table: str, market: Optional[str] = None) -> int:
+    # 指定市场时只关心该市场及未区分市场的写入；否则整张表任一市场写入都会使版本变化
+    with _data_versions_lock:
+        if market:
+            return data_versions.get(f"{table}:{market}", 0) + data_versions.get(f"{table}:*", 0)
+        return sum(v for k, v in data_versions.items() if k.startswith(f"{table}:"))
+
+# 行版本：全局单调递增序列保存在 data_versions 的 row_version 键中。分配发生在写事务内，
+# SQLite 同一时刻只有一个写事务，因此版本号顺序与提交顺序一致，客户端按版本号增量拉取不会漏行
+ROW_VERSION_KEY = "row_version"
+
+def init_row_versions():
+    with engine.begin() as conn:
+        conn.execute(text("INSERT OR IGNORE INTO data_versions (key, version) VALUES (:key, 1)"),
+                     {"key": ROW_VERSION_KEY})
+        # 增加 row_version 列之前已存在的行统一视为版本 1，首次同步（since=0）时全部返回
+        for table in VERSIONED_TABLES:
+            conn.execute(text(f"UPDATE {table} SET row_version = 1 WHERE row_version IS NULL"))
+
+def allocate_row_versions(session: Session, count: int) -> int:
+    """在当前事务内分配 count 个连续的行版本号，返回第一个"""
+    conn = session.connection()
+    conn.execute(text("UPDATE data_versions SET version = version + :count WHERE key = :key"),
+                 {"count": count, "key": ROW_VERSION_KEY})
+    last = conn.execute(text("SELECT version FROM data_versions WHERE key = :key"), {"key": ROW_VERSION_KEY}).scalar()
+    return last - count + 1
+
+def current_row_version(conn) -> int:
+    return conn.execute(text("SELECT version FROM data_versions WHERE key = :key"), {"key": ROW_VERSION_KEY}).scalar() or 0
+
+@event.listens_for(SessionLocal, "before_flush")
+def _track_touched_tables(session, flush_context, instances):
+    touched = session.info.setdefault("touched_tables", set())
+    written, deleted = [], []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table in VERSIONED_TABLES:
+            touched.add((table, getattr(obj, "market", None)))
+            if obj in session.deleted:
+                deleted.append(obj)
+            elif obj in session.new or session.is_modified(obj):
+                written.append(obj)
+    if not written and not deleted:
+        return
+    next_version = allocate_row_versions(session, len(written) + len(deleted))
+    for obj in written:
+        obj.row_version = next_version
+        next_version += 1
+    for obj in deleted:
+        session.add(DeletedRow(table_name=obj.__tablename__, row_id=obj.id, symbol=obj.symbol,
+                               market=obj.market, row_version=next_version))
+        next_version += 1
+
+@event.listens_for(SessionLocal, "after_commit")
+def _bump_versions_after_commit(session):
+    for table, market in session.info.pop("touched_tables", set()):
+        bump_data_version(table, market)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_touched_tables(session):
+    session.info.pop("touched_tables", None)
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "headers")
+
+    def __init__(self, body: bytes, etag: str, headers: Dict[str, str]):
+        self.body = body
+        self.etag = etag
+        self.headers = headers
+
+class ResponseCache:
+    """已序列化响应体的 LRU 缓存，键中包含数据版本号，版本变化后旧条目自然被淘汰"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, body: bytes, headers: Dict[str, str], etag: str) -> CachedResponse:
+        entry = CachedResponse(body, etag, headers)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            if len(body) <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += len(body)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 256)),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+)
+
+# 响应体超过该大小且客户端支持时才压缩，小页面压缩得不偿失
+COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", 32 * 1024))
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"无法序列化类型 {type(value).__name__}")
+
+def dumps_json(content: Any) -> bytes:
+    with profile_section("serialization"):
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+def rows_to_json(columns: List[str], rows: List[Tuple], response_format: str = "rows") -> bytes:
+    """直接把查询得到的元组序列化，跳过逐行 Pydantic 模型实例化；columnar 格式按列输出"""
+    with profile_section("serialization"):
+        if response_format == "columnar":
+            column_values = list(zip(*rows)) if rows else [()] * len(columns)
+            content = {name: list(values) for name, values in zip(columns, column_values)}
+        else:
+            content = [dict(zip(columns, row)) for row in rows]
+    return dumps_json(content)
+
+def response_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def _choose_encoding(request: Request) -> Optional[str]:
+    accept_encoding = request.headers.get("accept-encoding", "")
+    if brotli is not None and "br" in accept_encoding:
+        return "br"
+    if "gzip" in accept_encoding:
+        return "gzip"
+    return None
+
+def compress_body(body: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    if encoding is None or len(body) < COMPRESSION_MIN_BYTES:
+        return body, None
+    with profile_section("compression"):
+        if encoding == "br":
+            return brotli.compress(body, quality=5), "br"
+        return gzip.compress(body, compresslevel=5), "gzip"
+
+async def serve_cached_json(request: Request, endpoint: str, params: Dict[str, Any], version: Tuple,
+                            builder: Callable[[], Tuple[bytes, Dict[str, str]]]) -> Response:
+    """命中缓存直接返回已序列化的响应体；客户端 If-None-Match 与 ETag 一致时返回 304"""
+    encoding = _choose_encoding(request)
+    key = (endpoint, tuple(sorted(params.items())), version, encoding)
+    entry = response_cache.get(key)
+    cache_status = "HIT"
+    if entry is None:
+        def build_encoded():
+            body, headers = builder()
+            # ETag 取自未压缩的响应体：各 worker 的版本计数器彼此独立，只有内容相同的响应才会得到相同的 ETag
+            etag = response_etag(body)
+            body, content_encoding = compress_body(body, encoding)
+            if content_encoding:
+                headers = {**headers, "Content-Encoding": content_encoding}
+                etag = etag[:-1] + f'-{content_encoding}"'
+            return body, headers, etag
+        body, headers, etag = await run_in_threadpool(build_encoded)
+        entry = response_cache.put(key, body, headers, etag)
+        cache_status = "MISS"
+
+    headers = {**entry.headers, "ETag": entry.etag, "X-Cache": cache_status, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == entry.etag:
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+def _normalize_search(search_query: Optional[str]) -> Optional[str]:
+    if search_query is None:
+        return None
+    return search_query.strip() or None
+
 # API Config
 STOCK_APIS = {
     "tushare": {
@@ -236,10 +1061,15 @@ STOCK_APIS = {
 }
 
 # Valuation logic
+VALUATION_PGR_VALUES = [0.03, 0.05]
+VALUATION_RRR_VALUES = [0.08, 0.15]
+VALUATION_MID_PGR = 0.05
+VALUATION_MID_RRR = 0.10
+
 def calculate_valuation(book_value_per_share: float, roe: float,
                        perpetual_growth_rate: float, required_return_rate: float) -> ValuationResponse:
-    pgr_values = [0.03, 0.05]
-    rrr_values = [0.08, 0.15]
+    pgr_values = VALUATION_PGR_VALUES
+    rrr_values = VALUATION_RRR_VALUES
     all_calculated_pes = []
     all_theoretical_prices = []
     eps = book_value_per_share * roe
@@ -281,8 +1111,8 @@ def calculate_valuation(book_value_per_share: float, roe: float,
     min_theoretical_price = min(all_theoretical_prices)
     max_theoretical_price = max(all_theoretical_prices)
 
-    mid_pgr = 0.05
-    mid_rrr = 0.10
+    mid_pgr = VALUATION_MID_PGR
+    mid_rrr = VALUATION_MID_RRR
     eps = book_value_per_share * roe
 
     if mid_rrr > mid_pgr and roe != 0 and mid_pgr / roe <= 1 and mid_pgr / roe >= 0:
@@ -319,9 +1149,291 @@ def calculate_valuation(book_value_per_share: float, roe: float,
         pe_ratio_exact=round(exact_pe_ratio, 4) if exact_pe_ratio is not None else 0.0
     )
 
+def calculate_valuation_batch(book_value_per_share, roe) -> Dict[str, Any]:
+    """calculate_valuation 的向量化版本：一次计算整批股票的 PE/理论股价区间。
+    与逐只计算不同，没有任何有效参数组合的股票返回 NaN 而不是 0，避免被误判为高估"""
+    bvps = np.asarray(book_value_per_share, dtype=np.float64)
+    roe = np.asarray(roe, dtype=np.float64)
+    eps = bvps * roe
+
+    def pe_for(pgr: float, rrr: float):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            retention_ratio = pgr / roe
+            valid = (retention_ratio >= 0) & (retention_ratio <= 1) & (eps != 0)
+            return np.where(valid, (1 - retention_ratio) / (rrr - pgr), np.nan)
+
+    pes = np.vstack([pe_for(pgr, rrr) for pgr in VALUATION_PGR_VALUES for rrr in VALUATION_RRR_VALUES
+                     if rrr > pgr])
+    prices = pes * eps
+    mid_pe = pe_for(VALUATION_MID_PGR, VALUATION_MID_RRR)
+    # fmin/fmax 会忽略 NaN，只有全部组合都无效时结果才是 NaN
+    return {
+        "eps": eps,
+        "calculated_pe_lower": np.round(np.fmin.reduce(pes), 4),
+        "calculated_pe_upper": np.round(np.fmax.reduce(pes), 4),
+        "calculated_pe_mid": np.round(mid_pe, 4),
+        "theoretical_price_lower": np.round(np.fmin.reduce(prices), 4),
+        "theoretical_price_upper": np.round(np.fmax.reduce(prices), 4),
+        "theoretical_price_mid": np.round(mid_pe * eps, 4),
+    }
+
+# 出站 HTTP 连接池：akshare 内部直接使用 requests，每次调用都会新建 Session 和 TCP/TLS 连接。
+# 将 requests.Session 替换为子类：只有在 call_provider 调用 akshare 期间新建的 Session 才挂载共享 HTTPAdapter、
+# 使用 DNS 缓存，复用同一组按主机划分的 keep-alive 连接池；进程内其他库的请求行为不变
+HTTP_POOL_ENABLED = os.getenv("SHARED_HTTP_SESSION", "1") == "1"
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 8))      # 每个主机保留的 keep-alive 连接数
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", 32))         # 缓存连接池的主机数
+HTTP_DNS_CACHE_SECONDS = float(os.getenv("HTTP_DNS_CACHE_SECONDS", 300))
+HTTP_DNS_CACHE_MAX_ENTRIES = int(os.getenv("HTTP_DNS_CACHE_MAX_ENTRIES", 256))
+_provider_call_active: contextvars.ContextVar[bool] = contextvars.ContextVar("provider_call_active", default=False)
+
+class SharedHttpClient:
+    def __init__(self):
+        # pool_block=False：连接全部占用时临时新建连接，用完后不放回池中。requests 不会给取连接设置超时，
+        # 阻塞模式下线程可能无限期排队，PROVIDER_TIMEOUT_SECONDS 也约束不到这段等待
+        self.adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE, pool_block=False)
+        self.installed = False
+        self.dns_cache: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self._dns_lock = threading.Lock()
+        self._original_getaddrinfo = socket.getaddrinfo
+
+    def _cached_getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        if not _provider_call_active.get():
+            return self._original_getaddrinfo(host, port, family, type, proto, flags)
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._dns_lock:
+            cached = self.dns_cache.get(key)
+            if cached and now - cached[0] < HTTP_DNS_CACHE_SECONDS:
+                self.dns_hits += 1
+                return cached[1]
+        result = self._original_getaddrinfo(host, port, family, type, proto, flags)
+        with self._dns_lock:
+            self.dns_misses += 1
+            self.dns_cache.pop(key, None)
+            self.dns_cache[key] = (now, result)
+            # 按写入顺序淘汰：先清掉过期条目，仍超过上限时丢弃最早写入的条目
+            while self.dns_cache:
+                oldest_key, (cached_at, _) = next(iter(self.dns_cache.items()))
+                if now - cached_at < HTTP_DNS_CACHE_SECONDS and len(self.dns_cache) <= HTTP_DNS_CACHE_MAX_ENTRIES:
+                    break
+                del self.dns_cache[oldest_key]
+        return result
+
+    def install(self):
+        if self.installed:
+            return
+        client = self
+
+        class PooledSession(requests.sessions.Session):
+            def __init__(self):
+                super().__init__()
+                self._pooled = _provider_call_active.get()
+                if self._pooled:
+                    self.mount("https://", client.adapter)
+                    self.mount("http://", client.adapter)
+
+            def close(self):
+                # 共享连接池不随单个 Session 关闭；非 akshare 调用创建的 Session 按原样关闭
+                if not self._pooled:
+                    super().close()
+
+        requests.Session = requests.sessions.Session = requests.session = PooledSession
+        if HTTP_DNS_CACHE_SECONDS > 0:
+            socket.getaddrinfo = self._cached_getaddrinfo
+        self.installed = True
+        logging.info("已启用共享 HTTP 连接池")
+
+    def status(self) -> Dict[str, Any]:
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent = getattr(pool, "num_requests", 0)
+            connections = getattr(pool, "num_connections", 0)
+            hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "requests": requests_sent,
+                "connections_opened": connections,
+                "reused": max(0, requests_sent - connections),
+                "idle_connections": pool.pool.qsize() if pool.pool is not None else 0,
+            }
+        total_requests = sum(h["requests"] for h in hosts.values())
+        total_reused = sum(h["reused"] for h in hosts.values())
+        return {
+            "enabled": self.installed,
+            "hosts": hosts,
+            "reuse_ratio": round(total_reused / total_requests, 3) if total_requests else None,
+            "dns_cache": {"entries": len(self.dns_cache), "hits": self.dns_hits, "misses": self.dns_misses},
+        }
+
+shared_http = SharedHttpClient()
+
+# 上游接口保护：每个 akshare 接口一个熔断器，重试使用带抖动的指数退避并受全局重试预算限制
+PROVIDER_TIMEOUT_SECONDS = float(os.getenv("PROVIDER_TIMEOUT_SECONDS", 10))
+PROVIDER_MAX_ATTEMPTS = int(os.getenv("PROVIDER_MAX_ATTEMPTS", 3))
+# 全量行情/报表接口一次调用要分页请求数十次，重试会成倍放大请求量（新浪对频繁抓取会临时封禁 IP），
+# 只尝试一次，失败后等下一次定时任务
+PROVIDER_MAX_ATTEMPTS_OVERRIDES = {
+    "stock_zh_a_spot": 1,
+    "stock_hk_spot": 1,
+    "stock_us_spot": 1,
+    "stock_us_spot_em": 1,
+    "stock_yjbb_em": 1,
+}
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """滑动窗口内错误率超过阈值即熔断快速失败，冷却后放行少量半开探测请求，探测成功则恢复"""
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 cooldown_seconds: float = 60, half_open_probes: int = 1):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown_seconds = cooldown_seconds
+        self.half_open_probes = half_open_probes
+        self.state = "closed"
+        self.results: deque = deque(maxlen=window)
+        self.opened_at: Optional[float] = None
+        self.probes_in_flight = 0
+        self.rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = "half_open"
+                self.probes_in_flight = 0
+            if self.state == "half_open":
+                if self.probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self.probes_in_flight += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state == "half_open":
+                logging.info(f"熔断器 {self.name} 半开探测成功，恢复正常")
+                self.state = "closed"
+                self.results.clear()
+            self.results.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == "half_open":
+                self._open()
+                return
+            self.results.append(False)
+            failures = self.results.count(False)
+            if len(self.results) >= self.min_calls and failures / len(self.results) >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        if self.state != "open":
+            self.times_opened += 1
+            logging.warning(f"熔断器 {self.name} 打开，{self.cooldown_seconds}s 内直接拒绝请求")
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = len(self.results)
+            return {
+                "state": self.state,
+                "error_rate": round(self.results.count(False) / calls, 3) if calls else 0.0,
+                "recent_calls": calls,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+                "retry_in_seconds": round(max(0.0, self.cooldown_seconds - (time.monotonic() - self.opened_at)), 1)
+                if self.state == "open" else None,
+            }
+
+class RetryBudget:
+    """全局重试预算（令牌桶）：每个请求存入 ratio 个令牌，每次重试消耗一个，上游故障时重试总量有上限"""
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10, max_tokens: float = 50):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+        self.retries = 0
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.retries += 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"tokens": round(self.tokens, 2), "retries": self.retries, "exhausted": self.exhausted}
+
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+retry_budget = RetryBudget()
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    with _circuit_breakers_lock:
+        if endpoint not in circuit_breakers:
+            circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+        return circuit_breakers[endpoint]
+
+def _should_retry(retry_state, max_attempts: int) -> bool:
+    exc = retry_state.outcome.exception()
+    if exc is None or isinstance(exc, CircuitOpenError):
+        return False
+    if retry_state.attempt_number >= max_attempts:
+        return False
+    return retry_budget.try_spend()
+
+def call_provider(endpoint: str, fn: Callable, *args, **kwargs):
+    """经熔断器与重试预算调用上游接口；熔断打开时直接抛出 CircuitOpenError"""
+    breaker = get_circuit_breaker(endpoint)
+    retry_budget.record_request()
+
+    def attempt():
+        if not breaker.allow():
+            raise CircuitOpenError(f"接口 {endpoint} 已熔断")
+        token = _provider_call_active.set(True)  # 只有这段调用中新建的 Session 使用共享连接池
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            breaker.record_failure()
+            raise
+        finally:
+            _provider_call_active.reset(token)
+        breaker.record_success()
+        return result
+
+    max_attempts = PROVIDER_MAX_ATTEMPTS_OVERRIDES.get(endpoint, PROVIDER_MAX_ATTEMPTS)
+    retrying = Retrying(stop=stop_after_attempt(max_attempts),
+                        wait=wait_random_exponential(multiplier=0.5, max=8),
+                        retry=lambda retry_state: _should_retry(retry_state, max_attempts), reraise=True)
+    return retrying(attempt)
+
 # Stock data fetching
-async def fetch_stock_data_akshare(symbol: str, market: str) -> Dict[str, Any]:
-    return await run_in_threadpool(_fetch_stock_data_akshare_sync, symbol, market)
+async def fetch_stock_data_akshare(symbol: str, market: str, required_fields: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    return await run_in_threadpool(quote_router.fetch, symbol, market, required_fields)
 
 def _fetch_stock_data_akshare_sync(symbol: str, market: str) -> Dict[str, Any]:
     try:
@@ -329,8 +1441,9 @@ def _fetch_stock_data_akshare_sync(symbol: str, market: str) -> Dict[str, Any]:
         df = pd.DataFrame()
 
         if market == "A股" or market == "H股" or market == "美股": # Unified to use ak.stock_individual_spot_xq
-            logging.info(f"尝试使用 ak.stock_individual_spot_xq 获取 {market} {symbol} 数据...")
-            df = ak.stock_individual_spot_xq(symbol=symbol)
+            logging.debug(f"尝试使用 ak.stock_individual_spot_xq 获取 {market} {symbol} 数据...")
+            df = call_provider("stock_individual_spot_xq", ak.stock_individual_spot_xq,
+                               symbol=symbol, timeout=PROVIDER_TIMEOUT_SECONDS)
             if not df.empty:
                 data = df.set_index('item').to_dict()['value']
                 try:
@@ -353,72 +1466,342 @@ def _fetch_stock_data_akshare_sync(symbol: str, market: str) -> Dict[str, Any]:
                     market_data["book_value_per_share"] = float(bvps_val) if bvps_val is not None else 0.0
                     market_data["roe"] = (market_data["eps"] / market_data["book_value_per_share"]) if market_data["book_value_per_share"] else 0.0
                 except Exception as e:
-                    logging.error(f"解析 {market} {symbol} 数据失败: {e}")
+                    logging.error(f"解析 {market} {symbol} 数据失败: {e}", extra={"sample_key": "quote_parse_error"})
                     return {}
             else:
-                logging.warning(f"尝试使用 ak.stock_individual_spot_xq 未找到 {market} {symbol} 的数据。")
+                logging.warning(f"尝试使用 ak.stock_individual_spot_xq 未找到 {market} {symbol} 的数据。",
+                                extra={"sample_key": "quote_not_found"})
                 return {}
 
         return market_data
     except Exception as e:
-        logging.error(f"获取股票数据失败 {symbol} ({market}): {e}")
+        logging.error(f"获取股票数据失败 {symbol} ({market}): {e}", extra={"sample_key": "quote_fetch_error"})
     return {}
 
+# 行情数据源：主数据源超过其 p95 延迟仍未返回时向备用数据源发出对冲请求，先返回有效数据者胜出
+class QuoteProvider(ABC):
+    """行情数据源基类，fetch 返回与 _fetch_stock_data_akshare_sync 相同结构的字典，失败返回 {}"""
+    name = "base"
+    markets: Tuple[str, ...] = ("A股", "H股", "美股")
+    fields: Tuple[str, ...] = ("current_price", "change_percent", "volume", "market_cap", "name",
+                               "current_pe", "eps", "book_value_per_share", "roe")
+
+    def supports(self, market: str, required_fields: Tuple[str, ...] = ()) -> bool:
+        return market in self.markets and set(required_fields) <= set(self.fields)
+
+    @abstractmethod
+    def fetch(self, symbol: str, market: str) -> Dict[str, Any]:
+        ...
+
+class XueqiuQuoteProvider(QuoteProvider):
+    name = "xueqiu"
+
+    def fetch(self, symbol: str, market: str) -> Dict[str, Any]:
+        return _fetch_stock_data_akshare_sync(symbol, market)
+
+class EastmoneyQuoteProvider(QuoteProvider):
+    """东方财富行情报价，只提供价格、涨跌幅和成交量，估值字段仍以雪球为准"""
+    name = "eastmoney"
+    markets = ("A股",)
+    fields = ("current_price", "change_percent", "volume")
+
+    def fetch(self, symbol: str, market: str) -> Dict[str, Any]:
+        df = call_provider("stock_bid_ask_em", ak.stock_bid_ask_em, symbol=re.sub(r"\D", "", symbol))
+        if df.empty:
+            return {}
+        data = df.set_index('item')['value'].to_dict()
+        if data.get('最新') in (None, "-"):
+            return {}
+        return {
+            "current_price": float(data['最新']),
+            "change_percent": float(data.get('涨幅') or 0.0),
+            "volume": float(data.get('总手') or 0.0),
+        }
+
+QUOTE_PROVIDER_CLASSES = {
+    "xueqiu": XueqiuQuoteProvider,
+    "eastmoney": EastmoneyQuoteProvider,
+}
+
+class ProviderStats:
+    def __init__(self, window: int = 200):
+        self.latencies: deque = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self.latencies.append(latency)
+            if ok:
+                self.successes += 1
+            else:
+                self.failures += 1
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "samples": len(self.latencies),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "wins": self.wins,
+        }
+
+class QuoteRouter:
+    def __init__(self, providers: List[QuoteProvider], min_samples: int = 20,
+                 default_deadline: float = 2.0, min_deadline: float = 0.2, max_deadline: float = 10.0,
+                 overall_timeout: float = 30.0):
+        self.min_samples = min_samples
+        self.default_deadline = default_deadline
+        self.min_deadline = min_deadline
+        self.max_deadline = max_deadline
+        self.overall_timeout = overall_timeout
+        self.hedges_sent = 0
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="quote-provider")
+        self.set_providers(providers)
+
+    def set_providers(self, providers: List[QuoteProvider]):
+        """替换数据源列表（按优先级排序），测试时可换成本地假数据源"""
+        self.providers = list(providers)
+        self.stats = {p.name: ProviderStats() for p in self.providers}
+
+    def deadline_for(self, provider: QuoteProvider) -> float:
+        stats = self.stats[provider.name]
+        if len(stats.latencies) < self.min_samples:
+            return self.default_deadline
+        return min(self.max_deadline, max(self.min_deadline, stats.percentile(0.95)))
+
+    def _timed_fetch(self, provider: QuoteProvider, symbol: str, market: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            result = provider.fetch(symbol, market) or {}
+        except Exception as e:
+            logging.error(f"数据源 {provider.name} 获取 {symbol} ({market}) 失败: {e}",
+                          extra={"sample_key": f"provider_error:{provider.name}"})
+            result = {}
+        self.stats[provider.name].record(time.perf_counter() - started, bool(result))
+        return result
+
+    def fetch(self, symbol: str, market: str, required_fields: Tuple[str, ...] = ()) -> Dict[str, Any]:
+        """required_fields 非空时只向能提供这些字段的数据源请求，且只接受包含这些字段的结果"""
+        candidates = [p for p in self.providers if p.supports(market, required_fields)]
+        if not candidates:
+            return {}
+        give_up_at = time.monotonic() + self.overall_timeout
+        pending: Dict[Any, QuoteProvider] = {}
+
+        def launch(provider: QuoteProvider) -> float:
+            pending[self._executor.submit(self._timed_fetch, provider, symbol, market)] = provider
+            return self.deadline_for(provider)
+
+        deadline = launch(candidates.pop(0))
+        while pending:
+            remaining_time = give_up_at - time.monotonic()
+            if remaining_time <= 0:
+                logging.warning(f"所有数据源获取 {symbol} ({market}) 超时", extra={"sample_key": "provider_timeout"})
+                return {}
+            timeout = min(deadline, remaining_time) if candidates else remaining_time
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                result = future.result()
+                if result and all(field in result for field in required_fields):
+                    self.stats[provider.name].record_win()
+                    return result
+            # 主数据源超时（对冲）或已失败（降级）时，向下一个数据源发出请求
+            if candidates and (not done or not pending):
+                if not done:
+                    self.hedges_sent += 1
+                deadline = launch(candidates.pop(0))
+        return {}
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "providers": {p.name: {**self.stats[p.name].to_dict(), "markets": list(p.markets),
+                                   "deadline_ms": round(self.deadline_for(p) * 1000, 1)}
+                          for p in self.providers},
+            "hedges_sent": self.hedges_sent,
+        }
+
+QUOTE_PROVIDERS = [name.strip() for name in os.getenv("QUOTE_PROVIDERS", "xueqiu,eastmoney").split(",") if name.strip()]
+_unknown_providers = [name for name in QUOTE_PROVIDERS if name not in QUOTE_PROVIDER_CLASSES]
+if _unknown_providers:
+    raise RuntimeError(f"QUOTE_PROVIDERS 包含未知的数据源: {', '.join(_unknown_providers)}，"
+                       f"可选值: {', '.join(QUOTE_PROVIDER_CLASSES)}")
+quote_router = QuoteRouter([QUOTE_PROVIDER_CLASSES[name]() for name in QUOTE_PROVIDERS])
+# 自选股基本面刷新必须拿到估值字段，只报价格的备用数据源不参与
+FUNDAMENTAL_QUOTE_FIELDS = ("current_pe", "book_value_per_share", "roe")
+
+# 各市场全量行情接口；行情表短时间内缓存，全市场入库与自选股批量行情共用同一次下载
+MARKET_SPOT_FETCHERS = {
+    "A股": "stock_zh_a_spot",
+    "H股": "stock_hk_spot",
+    "美股": "stock_us_spot",
+}
+SPOT_FRAME_TTL_SECONDS = float(os.getenv("SPOT_FRAME_TTL_SECONDS", 120))
+_spot_frame_cache: Dict[str, Tuple[float, Any]] = {}
+_spot_frame_locks = {market: threading.Lock() for market in MARKET_SPOT_FETCHERS}
+
+def fetch_market_spot_frame(market_type: str):
+    with _spot_frame_locks[market_type]:
+        cached = _spot_frame_cache.get(market_type)
+        if cached and time.monotonic() - cached[0] < SPOT_FRAME_TTL_SECONDS:
+            return cached[1]
+        fetcher_name = MARKET_SPOT_FETCHERS[market_type]
+        df = call_provider(fetcher_name, getattr(ak, fetcher_name))
+        if not df.empty:
+            _spot_frame_cache[market_type] = (time.monotonic(), df)
+        return df
+
+def _to_float(value) -> Optional[float]:
+    """None 和 NaN 都视为缺失返回 None，缺失的价格不能存成 0.0；无法解析的值抛出异常由调用方记录"""
+    if value is None:
+        return None
+    value = float(value)
+    return None if value != value else value
+
+def _parse_market_frame(market_type: str, df) -> Dict[str, Tuple[str, Optional[float], Optional[float]]]:
+    """把各市场行情表统一解析为 {symbol: (name, current_price, change_percent)}"""
+    fetched = {}
+    for row in df.to_dict("records"):
+        if market_type == "H股":
+            name = row.get('中文名称') or row.get('名称') or str(row['代码'])
+            symbol = str(row['代码']) # H股的代码是 '代码'
+            current_price, change_percent = row.get('最新价'), row.get('涨跌幅')
+        elif market_type == "美股":
+            name = row.get('cname') or row.get('name', "")
+            symbol = str(row['symbol']) # 美股的代码是 'symbol'
+            current_price, change_percent = row.get('price'), row.get('chg')
+        else: # A股
+            name = row['名称']
+            symbol = str(row['代码']) # A股的代码是 '代码'
+            current_price, change_percent = row.get('最新价'), row.get('涨跌幅')
+
+        if not symbol:
+            logging.warning(f"跳过无股票代码的行: {row}", extra={"sample_key": f"market_missing_symbol:{market_type}"})
+            continue
+        try:
+            fetched[symbol] = (name, _to_float(current_price), _to_float(change_percent))
+        except (TypeError, ValueError) as e:
+            logging.error(f"解析{market_type}股票 {symbol} 行情失败: {e}", extra={"sample_key": f"market_parse_error:{market_type}"})
+    return fetched
+
+# 行情表返回的行数低于该市场在场股票数的这一比例时视为截断的响应，本次不标记消失的股票
+MARKET_PRESENCE_MIN_RATIO = float(os.getenv("MARKET_PRESENCE_MIN_RATIO", 0.8))
+
+def _diff_market_rows(db: Session, market_type: str, fetched: Dict[str, Tuple]) -> Tuple[List[Dict], List[Dict], List[Dict], Dict[str, int]]:
+    """与库中该市场的现有行情快照比对，返回 (新增, 行情变化, 仅在场状态变化, 计数)。
+    本次行情表中消失的股票记录 missing_since（重新出现时清除），供数据库维护任务按保留期清理；
+    这类在场状态变化单独计入 missing/returned，不算作行情变化"""
+    existing = {
+        symbol: (stock_id, name, price, change, eps, pe_lower, pe_upper, missing_since)
+        for stock_id, symbol, name, price, change, eps, pe_lower, pe_upper, missing_since in db.query(
+            WholeMarketStock.id, WholeMarketStock.symbol, WholeMarketStock.name,
+            WholeMarketStock.current_price, WholeMarketStock.change_percent, WholeMarketStock.eps,
+            WholeMarketStock.calculated_pe_lower, WholeMarketStock.calculated_pe_upper, WholeMarketStock.missing_since
+        ).filter(WholeMarketStock.market == market_type)
+    }
+    # symbol 在全表唯一，其他市场已占用的代码无法插入
+    other_market_symbols = set()
+    if any(symbol not in existing for symbol in fetched):
+        other_market_symbols = {symbol for (symbol,) in db.query(WholeMarketStock.symbol)
+                                .filter(WholeMarketStock.market != market_type)}
+
+    now = datetime.now(timezone.utc)
+    inserts, updates, presence = [], [], []
+    counts = {"unchanged": 0, "skipped": 0, "missing": 0, "returned": 0}
+    for symbol, (name, price, change) in fetched.items():
+        current = existing.get(symbol)
+        if current is None:
+            if symbol in other_market_symbols:
+                counts["skipped"] += 1
+                continue
+            inserts.append({"symbol": symbol, "name": name, "market": market_type, "current_price": price,
+                            "change_percent": change, "last_updated": now, "is_watchlist": False})
+            continue
+        if current[7] is not None:
+            counts["returned"] += 1
+        if current[1:4] == (name, price, change):
+            counts["unchanged"] += 1
+            if current[7] is not None:
+                presence.append({"id": current[0], "missing_since": None})
+        else:
+            update = {"id": current[0], "name": name, "current_price": price,
+                      "change_percent": change, "last_updated": now}
+            if current[7] is not None:
+                update["missing_since"] = None
+            # 已有批量基本面的股票随现价重新计算 PE 和估值状态
+            eps, pe_lower, pe_upper = current[4:7]
+            if price is not None and eps is not None and eps > 0:
+                update["current_pe"] = round(price / eps, 4)
+                update["valuation_status"] = valuation_status_of(update["current_pe"], pe_lower, pe_upper)
+            updates.append(update)
+    active_count = sum(1 for current in existing.values() if current[7] is None)
+    if fetched and len(fetched) < active_count * MARKET_PRESENCE_MIN_RATIO:
+        logging.warning(f"{market_type}行情表仅返回 {len(fetched)} 行，低于在场股票数 {active_count} 的 "
+                        f"{MARKET_PRESENCE_MIN_RATIO:.0%}，疑似数据不完整，本次跳过消失股票标记")
+    elif fetched:
+        missing = [{"id": current[0], "missing_since": now} for symbol, current in existing.items()
+                   if current[7] is None and symbol not in fetched]
+        counts["missing"] = len(missing)
+        presence.extend(missing)
+    return inserts, updates, presence, counts
+
+def _write_market_batch(db: Session, market_type: str, batch: List[Tuple[str, Dict]]):
+    inserts = [mapping for kind, mapping in batch if kind == "insert"]
+    updates = [mapping for kind, mapping in batch if kind != "insert"]
+    next_version = allocate_row_versions(db, len(batch))
+    for offset, mapping in enumerate(inserts + updates):
+        mapping["row_version"] = next_version + offset
+    if inserts:
+        db.bulk_insert_mappings(WholeMarketStock, inserts)
+    if updates:
+        db.bulk_update_mappings(WholeMarketStock, updates)
+    db.commit()
+    # bulk 操作不经过 flush 事件，需要手动递增数据版本
+    bump_data_version("whole_market_stocks", market_type)
+
 async def update_full_market_data_by_market(market_type: str, db: Session):
     global full_market_update_status
     current_market_status = full_market_update_status[market_type]
     current_market_status["status"] = "进行中"
     current_market_status["message"] = f"开始更新 {market_type} 股票基本信息..."
+    for counter in ("new", "changed", "unchanged", "skipped", "missing", "returned", "failed_rows"):
+        current_market_status[counter] = 0
     current_market_status["progress"] = 0
     full_market_update_status[market_type] = current_market_status
 
     logging.info(f"开始更新 {market_type} 股票基本信息...")
     try:
-        df = pd.DataFrame()
-        if market_type == "A股":
-            current_market_status["message"] = "正在获取A股股票数据..."
-            current_market_status["progress"] = 5
-            logging.info("正在获取A股股票数据... (使用 ak.stock_zh_a_spot())")
-            try:
-                def get_a_stocks_with_retry_sync():
-                    return ak.stock_zh_a_spot()
-                df = await run_in_threadpool(get_a_stocks_with_retry_sync)
-            except Exception as e:
-                logging.error(f"多次尝试获取A股股票数据失败: {e}")
-                current_market_status["status"] = "失败"
-                current_market_status["message"] = f"获取A股股票数据失败: {e}"
-                current_market_status["progress"] = -1
-                return
-        elif market_type == "H股":
-            current_market_status["message"] = "正在获取H股股票数据..."
-            current_market_status["progress"] = 5
-            logging.info("正在获取H股股票数据...")
-            try:
-                def get_h_stocks_with_retry_sync():
-                    return ak.stock_hk_spot()
-                df = await run_in_threadpool(get_h_stocks_with_retry_sync)
-            except Exception as e:
-                logging.error(f"多次尝试获取H股股票数据失败: {e}")
-                current_market_status["status"] = "失败"
-                current_market_status["message"] = f"获取H股股票数据失败: {e}"
-                current_market_status["progress"] = -1
-                return
-        elif market_type == "美股":
-            current_market_status["message"] = "正在获取美股股票数据..."
-            current_market_status["progress"] = 5
-            logging.info("正在获取美股股票数据...")
-            try:
-                def get_us_stocks_with_retry_sync():
-                    return ak.stock_us_spot()
-                df = await run_in_threadpool(get_us_stocks_with_retry_sync)
-            except Exception as e:
-                logging.error(f"多次尝试获取美股股票数据失败: {e}")
-                current_market_status["status"] = "失败"
-                current_market_status["message"] = f"获取美股股票数据失败: {e}。请检查 `akshare` 美股接口是否可用。"
-                current_market_status["progress"] = -1
-                return
-        else:
+        if market_type not in MARKET_SPOT_FETCHERS:
             raise HTTPException(status_code=400, detail="不支持的市场类型")
+        current_market_status["message"] = f"正在获取{market_type}股票数据..."
+        current_market_status["progress"] = 5
+        logging.info(f"正在获取{market_type}股票数据... (使用 ak.{MARKET_SPOT_FETCHERS[market_type]}())")
+        try:
+            df = await run_in_threadpool(fetch_market_spot_frame, market_type)
+        except Exception as e:
+            logging.error(f"多次尝试获取{market_type}股票数据失败: {e}")
+            current_market_status["status"] = "失败"
+            current_market_status["message"] = f"获取{market_type}股票数据失败: {e}"
+            if market_type == "美股":
+                current_market_status["message"] += "。请检查 `akshare` 美股接口是否可用。"
+            current_market_status["progress"] = -1
+            return
 
         if df.empty:
             logging.warning(f"获取{market_type}股票数据失败，返回为空。")
@@ -431,80 +1814,65 @@ async def update_full_market_data_by_market(market_type: str, db: Session):
 
         current_market_status["message"] = f"开始处理 {len(df)} 只{market_type}股票..."
         logging.info(f"开始处理 {len(df)} 只{market_type}股票...")
-        for i, (_, row) in enumerate(df.iterrows()):
-            symbol = ""
-            name = ""
-
-            if market_type == "H股":
-                name = row.get('中文名称') or row.get('名称') or str(row['代码'])
-                symbol = str(row['代码']) # H股的代码是 '代码'
-            elif market_type == "美股":
-                name = row.get('cname') or row.get('name', "")
-                symbol = str(row['symbol']) # 美股的代码是 'symbol'
-            else: # A股
-                name = row['名称']
-                symbol = str(row['代码']) # A股的代码是 '代码'
-
-            if not symbol:
-                logging.warning(f"跳过无股票代码的行: {row.to_dict()}")
-                continue
-
-            market = market_type
+        fetched = _parse_market_frame(market_type, df)
+
+        # 差异比对：只写入新增股票和行情真正发生变化的股票
+        current_market_status["message"] = f"正在比对 {len(fetched)} 只{market_type}股票的行情变化..."
+        inserts, updates, presence, counts = await run_in_threadpool(_diff_market_rows, db, market_type, fetched)
+        unchanged = counts["unchanged"]
+        current_market_status["new"] = len(inserts)
+        current_market_status["changed"] = len(updates)
+        for counter in ("unchanged", "skipped", "missing", "returned"):
+            current_market_status[counter] = counts[counter]
+        logging.info(f"{market_type} 行情比对完成: 新增 {len(inserts)}，变化 {len(updates)}，未变化 {unchanged}，"
+                     f"跳过 {counts['skipped']}，消失 {counts['missing']}，重新出现 {counts['returned']}")
+
+        pending_writes = ([("insert", m) for m in inserts] + [("update", m) for m in updates]
+                          + [("presence", m) for m in presence])
+        # 计数只统计已提交的行；写入失败的批次已回滚，不计入新增/变化/消失/重新出现
+        written = {"new": 0, "changed": 0, "missing": 0, "returned": 0}
+        failed_batches, failed_rows = 0, 0
+        for start in range(0, len(pending_writes), BATCH_SIZE):
+            batch = pending_writes[start:start + BATCH_SIZE]
             try:
-                current_price = None
-                change_percent = None
-
-                if market_type == "A股":
-                    current_price = row.get('最新价')
-                    change_percent = row.get('涨跌幅')
-                elif market_type == "H股":
-                    current_price = row.get('最新价') # 再次确认H股是'最新价'
-                    change_percent = row.get('涨跌幅') # 再次确认H股是'涨跌幅'
-                elif market_type == "美股":
-                    current_price = row.get('price')
-                    change_percent = row.get('chg')
-
-                current_price_val = float(current_price) if current_price is not None else 0.0
-                change_percent_val = float(change_percent) if change_percent is not None else 0.0
-
-                existing_stock = await run_in_threadpool(lambda: db.query(WholeMarketStock).filter(WholeMarketStock.symbol == symbol, WholeMarketStock.market == market).first())
-
-                if existing_stock:
-                    existing_stock.current_price = current_price_val
-                    existing_stock.change_percent = change_percent_val
-                    existing_stock.last_updated = datetime.now(timezone.utc)
-                    existing_stock.name = name
-                else:
-                    new_whole_market_stock = WholeMarketStock(
-                        symbol=symbol,
-                        name=name,
-                        market=market,
-                        current_price=current_price_val,
-                        change_percent=change_percent_val,
-                        last_updated=datetime.now(timezone.utc),
-                        is_watchlist=False
-                    )
-                    await run_in_threadpool(lambda: db.add(new_whole_market_stock))
-
-                if (i + 1) % BATCH_SIZE == 0 or (i + 1) == len(df):
-                    await run_in_threadpool(lambda: db.commit())
-                    await run_in_threadpool(lambda: db.expire_all())
-                    current_market_status["progress"] = 5 + int(90 * (i + 1) / len(df))
-                    current_market_status["message"] = f"正在写入 {market_type} 股票数据 ({i+1}/{len(df)}), 已提交一批次。"
-                    logging.info(f"已提交 {market_type} 股票数据 ({i+1}/{len(df)})，最新进度 {current_market_status['progress']}%")
-                    await asyncio.sleep(0.01)
-                else:
-                    current_market_status["progress"] = 5 + int(90 * (i + 1) / len(df))
-                    current_market_status["message"] = f"正在缓存 {market_type} 股票数据 ({i+1}/{len(df)}): {name} ({symbol})"
-
+                await run_in_threadpool(_write_market_batch, db, market_type, batch)
             except Exception as e:
                 await run_in_threadpool(lambda: db.rollback())
-                logging.error(f"处理{market_type}股票 {symbol} ({market}) 写入数据库失败: {e}")
-
-        current_market_status["status"] = "完成"
-        current_market_status["message"] = f"{market_type} 股票基本信息更新完成。"
-        current_market_status["progress"] = 100
-        logging.info(f"{market_type} 股票基本信息更新完成。")
+                failed_batches += 1
+                failed_rows += len(batch)
+                logging.error(f"写入{market_type}股票数据批次 ({start}-{start + len(batch)}) 失败: {e}")
+            else:
+                for kind, mapping in batch:
+                    if kind == "insert":
+                        written["new"] += 1
+                    elif kind == "update":
+                        written["changed"] += 1
+                    if "missing_since" in mapping:
+                        written["missing" if mapping["missing_since"] is not None else "returned"] += 1
+            done = start + len(batch)
+            current_market_status["progress"] = 5 + int(90 * done / len(pending_writes))
+            current_market_status["message"] = f"正在写入 {market_type} 股票数据 ({done}/{len(pending_writes)}), 已提交一批次。"
+            await asyncio.sleep(0.01)
+
+        for counter, value in written.items():
+            current_market_status[counter] = value
+        current_market_status["failed_rows"] = failed_rows
+        summary = f"新增 {written['new']}，变化 {written['changed']}，未变化 {unchanged}"
+        if failed_batches == 0:
+            current_market_status["status"] = "完成"
+            current_market_status["message"] = f"{market_type} 股票基本信息更新完成：{summary}。"
+            current_market_status["progress"] = 100
+        else:
+            all_failed = failed_rows == len(pending_writes)
+            current_market_status["status"] = "失败" if all_failed else "部分失败"
+            current_market_status["message"] = (f"{market_type} 股票基本信息更新{'失败' if all_failed else '部分失败'}：{summary}，"
+                                                 f"{failed_batches} 个批次共 {failed_rows} 行写入失败，请检查日志。")
+            current_market_status["progress"] = -1 if all_failed else 99
+        log = logging.info if failed_batches == 0 else logging.warning
+        log(current_market_status["message"],
+            extra={"job": "update_full_market_data", "market": market_type, **written,
+                   "unchanged": unchanged, "skipped": counts["skipped"], "failed_rows": failed_rows})
+        await run_in_threadpool(market_snapshot.refresh)
 
     except Exception as e:
         await run_in_threadpool(lambda: db.rollback())
@@ -552,6 +1920,7 @@ async def update_full_market_data_overall():
             full_market_update_status["overall"]["message"] = "部分市场股票信息更新失败，请检查日志。"
             full_market_update_status["overall"]["progress"] = 99
             logging.warning("部分市场股票信息更新失败。")
+        await refresh_dashboard_snapshot()
 
     except Exception as e:
         full_market_update_status["overall"]["status"] = "失败"
@@ -561,15 +1930,423 @@ async def update_full_market_data_overall():
     finally:
         await run_in_threadpool(lambda: db.close())
 
+# 全市场基本面：按市场整批拉取 BVPS/EPS/ROE，写入 whole_market_stocks 后一次性向量化重新估值。
+# A股使用东财业绩报表（最近两期合并，新一期优先）；美股只有东财行情表中的市盈率，可由股价反推 EPS，
+# 缺少每股净资产，无法估值；港股暂无整批基本面接口
+FUNDAMENTAL_FETCHERS = {
+    "A股": "stock_yjbb_em",
+    "美股": "stock_us_spot_em",
+}
+FUNDAMENTALS_REPORT_LOOKBACK = int(os.getenv("FUNDAMENTALS_REPORT_LOOKBACK", 2))
+# 报告期结束后至少经过这么多天才去拉取，刚结束的季度东方财富尚无数据，接口会直接报错
+FUNDAMENTALS_REPORT_LAG_DAYS = int(os.getenv("FUNDAMENTALS_REPORT_LAG_DAYS", 15))
+# 累计报表期的 EPS/ROE 换算为年化值
+REPORT_ANNUALIZE_FACTORS = {"0331": 4.0, "0630": 2.0, "0930": 4.0 / 3, "1231": 1.0}
+
+background_job_status["fundamentals"] = _idle_job_status("fundamentals")
+
+def _normalize_symbol(market_type: str, symbol: str) -> str:
+    """行情表与基本面表的代码格式不同（sh600000 / 600000，AAPL / 105.AAPL），统一为不带前缀的代码"""
+    symbol = str(symbol).strip()
+    if market_type == "A股":
+        return re.sub(r"^(sh|sz|bj)", "", symbol.lower())
+    return re.sub(r"^\d+\.", "", symbol).upper()
+
+def _recent_report_dates(today: date, count: int, lag_days: int = 0) -> List[str]:
+    dates = []
+    year = today.year
+    cutoff = (today - timedelta(days=lag_days)).strftime("%Y%m%d")
+    while len(dates) < count:
+        for suffix in ("1231", "0930", "0630", "0331"):
+            report_date = f"{year}{suffix}"
+            if report_date < cutoff and len(dates) < count:
+                dates.append(report_date)
+        year -= 1
+    return dates
+
+def _to_optional_float(value) -> Optional[float]:
+    """与 _to_float 不同，"-"、空串及无法解析的值也返回 None 而不是抛出异常"""
+    if value is None or value in ("", "-"):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value != value else value
+
+def _positive(value: Optional[float]) -> Optional[float]:
+    return value if value is not None and value > 0 else None
+
+def fetch_market_fundamentals(market_type: str) -> Dict[str, Dict[str, Optional[float]]]:
+    """返回 {规范化代码: {eps, book_value_per_share, roe, current_pe, market_cap}}，缺失的值为 None"""
+    fetcher_name = FUNDAMENTAL_FETCHERS[market_type]
+    fundamentals: Dict[str, Dict[str, Optional[float]]] = {}
+    if market_type == "A股":
+        # 从旧到新依次覆盖，同一股票以最新一期报表为准；某一期获取失败或为空时跳过该期
+        report_dates = _recent_report_dates(date.today(), FUNDAMENTALS_REPORT_LOOKBACK, FUNDAMENTALS_REPORT_LAG_DAYS)
+        loaded = 0
+        for report_date in reversed(report_dates):
+            try:
+                df = call_provider(fetcher_name, getattr(ak, fetcher_name), date=report_date)
+            except Exception as e:
+                logging.warning(f"获取{market_type} {report_date} 期业绩报表失败，跳过该期: {e}")
+                continue
+            if df is None or df.empty:
+                logging.warning(f"{market_type} {report_date} 期业绩报表为空，跳过该期")
+                continue
+            loaded += 1
+            factor = REPORT_ANNUALIZE_FACTORS[report_date[4:]]
+            for row in df.to_dict("records"):
+                eps, bvps, roe = (_to_optional_float(row.get(k)) for k in ("每股收益", "每股净资产", "净资产收益率"))
+                fundamentals[_normalize_symbol(market_type, row["股票代码"])] = {
+                    "eps": eps * factor if eps is not None else None,
+                    "book_value_per_share": bvps,
+                    "roe": roe * factor / 100 if roe is not None else None,
+                }
+        if not loaded:
+            raise RuntimeError(f"最近 {len(report_dates)} 期业绩报表均获取失败: {', '.join(report_dates)}")
+    else:
+        df = call_provider(fetcher_name, getattr(ak, fetcher_name))
+        for row in df.to_dict("records"):
+            price, pe, total_cap = (_to_optional_float(row.get(k)) for k in ("最新价", "市盈率", "总市值"))
+            pe = _positive(pe)
+            fundamentals[_normalize_symbol(market_type, row["代码"])] = {
+                "eps": price / pe if price and pe else None,
+                "current_pe": pe,
+                "market_cap": total_cap / 100000000 if total_cap else None,  # 转换为亿元
+            }
+    return fundamentals
+
+def _write_market_fundamentals(market_type: str, fundamentals: Dict[str, Dict[str, Optional[float]]]) -> Tuple[int, int]:
+    """按代码匹配全市场表，向量化重新估值后整批写回，返回 (更新数量, 未匹配数量)"""
+    db = SessionLocal()
+    try:
+        rows = []
+        for stock_id, symbol, price in db.query(WholeMarketStock.id, WholeMarketStock.symbol,
+                                                WholeMarketStock.current_price).filter(WholeMarketStock.market == market_type):
+            fetched = fundamentals.get(_normalize_symbol(market_type, symbol))
+            if fetched is not None:
+                rows.append((stock_id, fetched, price))
+        if not rows:
+            return 0, len(fundamentals)
+
+        def column(field):
+            return np.array([np.nan if f.get(field) is None else f[field] for _, f, _ in rows], dtype=np.float64)
+
+        bvps, roe, eps = column("book_value_per_share"), column("roe"), column("eps")
+        prices = np.array([np.nan if p is None else p for _, _, p in rows], dtype=np.float64)
+        valuation = calculate_valuation_batch(bvps, roe)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            computed_pe = np.where(eps > 0, prices / eps, np.nan)
+        reported_pe = column("current_pe")
+        current_pe = np.round(np.where(np.isnan(reported_pe), computed_pe, reported_pe), 4)
+
+        lower, upper = valuation["calculated_pe_lower"], valuation["calculated_pe_upper"]
+        missing = np.isnan(current_pe) | np.isnan(lower) | np.isnan(upper)
+        with np.errstate(invalid="ignore"):
+            statuses = np.select([missing, current_pe < lower, current_pe > upper],
+                                 ["数据缺失", "低估", "高估"], default="合理")
+
+        columns = {"book_value_per_share": bvps, "eps": np.round(eps, 4), "roe": np.round(roe, 4),
+                   "current_pe": current_pe, "market_cap": column("market_cap"),
+                   **{k: v for k, v in valuation.items() if k != "eps"}}
+        names = list(columns)
+        now = datetime.now(timezone.utc)
+        mappings = []
+        for i, values in enumerate(zip(*(columns[name].tolist() for name in names))):
+            mapping = {name: None if v != v else v for name, v in zip(names, values)}
+            if "market_cap" not in rows[i][1]:
+                del mapping["market_cap"]  # 没有市值来源时保留库中原值
+            mapping.update(id=rows[i][0], valuation_status=str(statuses[i]), fundamentals_updated=now)
+            mappings.append(mapping)
+        next_version = allocate_row_versions(db, len(mappings))
+        for offset, mapping in enumerate(mappings):
+            mapping["row_version"] = next_version + offset
+        for start in range(0, len(mappings), BATCH_SIZE * 10):
+            db.bulk_update_mappings(WholeMarketStock, mappings[start:start + BATCH_SIZE * 10])
+        db.commit()
+        bump_data_version("whole_market_stocks", market_type)
+        return len(mappings), len(fundamentals) - len(mappings)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def update_whole_market_fundamentals():
+    job_status = background_job_status["fundamentals"]
+    job_status["status"] = "进行中"
+    job_status["message"] = "开始批量更新全市场基本面..."
+    job_status["progress"] = 0
+    markets = list(MARKET_SPOT_FETCHERS)
+    summary, failed_markets = {}, []
+    try:
+        for i, market_type in enumerate(markets):
+            if market_type not in FUNDAMENTAL_FETCHERS:
+                summary[market_type] = "暂无整批基本面数据源"
+                continue
+            job_status["message"] = f"正在获取{market_type}基本面数据..."
+            try:
+                fundamentals = await run_in_threadpool(fetch_market_fundamentals, market_type)
+                updated, unmatched = await run_in_threadpool(_write_market_fundamentals, market_type, fundamentals)
+            except Exception as e:
+                logging.error(f"批量更新{market_type}基本面失败: {e}")
+                failed_markets.append(market_type)
+                summary[market_type] = f"失败: {e}"
+                continue
+            summary[market_type] = f"更新 {updated} 只，未匹配 {unmatched} 只"
+            logging.info(f"{market_type} 基本面更新完成: 更新 {updated} 只，未匹配 {unmatched} 只")
+            job_status["progress"] = int(100 * (i + 1) / len(markets)) - 1
+
+        job_status["status"] = "失败" if len(failed_markets) == len(FUNDAMENTAL_FETCHERS) else "完成"
+        job_status["markets"] = summary
+        job_status["message"] = "全市场基本面更新结束：" + "；".join(f"{m} {r}" for m, r in summary.items())
+        job_status["progress"] = 100 if job_status["status"] == "完成" else -1
+        logging.info(job_status["message"], extra={"job": "update_whole_market_fundamentals", "markets": summary})
+        await run_in_threadpool(market_snapshot.refresh)
+        await refresh_dashboard_snapshot()
+    except Exception as e:
+        job_status["status"] = "失败"
+        job_status["message"] = f"批量更新全市场基本面失败: {e}"
+        job_status["progress"] = -1
+        logging.error(f"批量更新全市场基本面失败: {e}")
+
+def valuation_status_of(current_pe: Optional[float], pe_lower: Optional[float], pe_upper: Optional[float]) -> str:
+    if current_pe is None or pe_lower is None or pe_upper is None:
+        return "数据缺失"
+    if current_pe < pe_lower:
+        return "低估"
+    if current_pe > pe_upper:
+        return "高估"
+    return "合理"
+
+# 价格/估值提醒：规则按股票代码建立有序阈值索引，每次 Stock 更新只检查被穿越的阈值
+ALERT_KINDS = {
+    "price_above": "股价上穿阈值",
+    "price_below": "股价下穿阈值",
+    "below_theoretical_lower": "股价跌破理论价格下限",
+    "above_theoretical_upper": "股价突破理论价格上限",
+    "undervalued": "进入低估区间",
+}
+ALERT_THRESHOLD_KINDS = ("price_above", "price_below")
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL", "")
+ALERT_EVENTS_BUFFER_SIZE = 500  # 最近触发的提醒事件保留条数
+
+class AlertIndex:
+    """单只股票的规则：固定阈值规则保存在按阈值排序的列表中，用二分查找定位被穿越的区间"""
+
+    def __init__(self):
+        self.above_thresholds: List[float] = []
+        self.above_rules: List[int] = []
+        self.below_thresholds: List[float] = []
+        self.below_rules: List[int] = []
+        self.dynamic_rules: List[Tuple[int, str]] = []
+
+    def add(self, rule_id: int, kind: str, threshold: Optional[float]):
+        if kind == "price_above":
+            pos = bisect_right(self.above_thresholds, threshold)
+            self.above_thresholds.insert(pos, threshold)
+            self.above_rules.insert(pos, rule_id)
+        elif kind == "price_below":
+            pos = bisect_right(self.below_thresholds, threshold)
+            self.below_thresholds.insert(pos, threshold)
+            self.below_rules.insert(pos, rule_id)
+        else:
+            self.dynamic_rules.append((rule_id, kind))
+
+    def __len__(self):
+        return len(self.above_rules) + len(self.below_rules) + len(self.dynamic_rules)
+
+class AlertEngine:
+    def __init__(self):
+        self._indexes: Dict[str, AlertIndex] = {}
+        self._loaded_version: Optional[int] = None
+        self._lock = threading.Lock()
+        self.events: deque = deque(maxlen=ALERT_EVENTS_BUFFER_SIZE)
+        self.outbox: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=10000)
+        self.metrics = {"evaluations": 0, "rules_checked": 0, "events_fired": 0,
+                        "events_dropped": 0, "eval_seconds": 0.0}
+
+    def _ensure_loaded(self):
+        # 规则变更会递增 alert_rules 数据版本，其他 worker 据此重新加载索引
+        version = get_data_version("alert_rules")
+        if self._loaded_version == version:
+            return
+        db = SessionLocal()
+        try:
+            rules = db.query(AlertRule.id, AlertRule.symbol, AlertRule.kind, AlertRule.threshold) \
+                .filter(AlertRule.enabled == True).all()
+        finally:
+            db.close()
+        indexes: Dict[str, AlertIndex] = {}
+        for rule_id, symbol, kind, threshold in rules:
+            indexes.setdefault(symbol, AlertIndex()).add(rule_id, kind, threshold)
+        with self._lock:
+            self._indexes = indexes
+            self._loaded_version = version
+
+    def capture(self, stock: Stock) -> Tuple:
+        """在更新前记录与提醒相关的状态，供 evaluate 判断是否穿越阈值"""
+        return (stock.current_price, stock.theoretical_price_lower, stock.theoretical_price_upper,
+                valuation_status_of(stock.current_pe, stock.calculated_pe_lower, stock.calculated_pe_upper))
+
+    def evaluate(self, stock: Stock, before: Tuple) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        self._ensure_loaded()
+        index = self._indexes.get(stock.symbol)
+        fired: List[Tuple[int, str, Optional[float]]] = []
+        checked = 0
+        old_price, old_lower, old_upper, old_status = before
+        new_price = stock.current_price
+        if index is not None:
+            if old_price is not None and new_price is not None and old_price != new_price:
+                if new_price > old_price:
+                    lo = bisect_right(index.above_thresholds, old_price)
+                    hi = bisect_right(index.above_thresholds, new_price)
+                    fired += [(index.above_rules[i], "price_above", index.above_thresholds[i]) for i in range(lo, hi)]
+                    checked += hi - lo
+                else:
+                    lo = bisect_left(index.below_thresholds, new_price)
+                    hi = bisect_left(index.below_thresholds, old_price)
+                    fired += [(index.below_rules[i], "price_below", index.below_thresholds[i]) for i in range(lo, hi)]
+                    checked += hi - lo
+            for rule_id, kind in index.dynamic_rules:
+                checked += 1
+                if kind == "undervalued":
+                    new_status = valuation_status_of(stock.current_pe, stock.calculated_pe_lower, stock.calculated_pe_upper)
+                    if old_status != "低估" and new_status == "低估":
+                        fired.append((rule_id, kind, stock.calculated_pe_lower))
+                elif kind == "below_theoretical_lower" and None not in (old_price, new_price, old_lower, stock.theoretical_price_lower):
+                    if old_price >= old_lower and new_price < stock.theoretical_price_lower:
+                        fired.append((rule_id, kind, stock.theoretical_price_lower))
+                elif kind == "above_theoretical_upper" and None not in (old_price, new_price, old_upper, stock.theoretical_price_upper):
+                    if old_price <= old_upper and new_price > stock.theoretical_price_upper:
+                        fired.append((rule_id, kind, stock.theoretical_price_upper))
+
+        events = [self._emit(rule_id, kind, threshold, stock, old_price) for rule_id, kind, threshold in fired]
+        self.metrics["evaluations"] += 1
+        self.metrics["rules_checked"] += checked
+        self.metrics["eval_seconds"] += time.perf_counter() - started
+        return events
+
+    def _emit(self, rule_id: int, kind: str, threshold: Optional[float], stock: Stock, old_price) -> Dict[str, Any]:
+        event_payload = {
+            "rule_id": rule_id, "kind": kind, "description": ALERT_KINDS[kind],
+            "symbol": stock.symbol, "name": stock.name, "market": stock.market,
+            "threshold": threshold, "previous_price": old_price, "current_price": stock.current_price,
+            "fired_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.events.append(event_payload)
+        self.metrics["events_fired"] += 1
+        try:
+            self.outbox.put_nowait(event_payload)
+        except queue.Full:
+            self.metrics["events_dropped"] += 1
+        return event_payload
+
+    def status(self) -> Dict[str, Any]:
+        evaluations = self.metrics["evaluations"]
+        return {
+            **{k: v for k, v in self.metrics.items() if k != "eval_seconds"},
+            "avg_eval_us": round(self.metrics["eval_seconds"] / evaluations * 1e6, 2) if evaluations else None,
+            "indexed_symbols": len(self._indexes),
+            "indexed_rules": sum(len(index) for index in self._indexes.values()),
+            "outbox_size": self.outbox.qsize(),
+        }
+
+alert_engine = AlertEngine()
+
+def run_alert_dispatcher():
+    """后台投递提醒事件：配置了 ALERT_WEBHOOK_URL 时 POST 到 webhook，否则只写日志"""
+    while True:
+        event_payload = alert_engine.outbox.get()
+        try:
+            if ALERT_WEBHOOK_URL:
+                requests.post(ALERT_WEBHOOK_URL, json=event_payload, timeout=5)
+            logging.info(f"提醒触发: {event_payload['symbol']} {event_payload['description']} "
+                         f"阈值 {event_payload['threshold']} 现价 {event_payload['current_price']}")
+        except Exception as e:
+            logging.error(f"投递提醒事件失败: {e}")
+
+async def update_watchlist_quotes_bulk():
+    """批量刷新自选股行情：每个市场只下载一次全量行情表，按代码匹配后一次性更新价格和涨跌幅。
+    BVPS/EPS/PE 等基本面仍由 update_watchlist_stocks 逐只获取，频率更低；无有效价格的股票计入未匹配"""
+    job_status = background_job_status["watchlist_quotes"]
+    job_status["status"] = "进行中"
+    job_status["message"] = "开始批量刷新自选股行情..."
+    job_status["progress"] = 0
+    # 本任务写入的字段在提交后仍然有效，关闭提交后过期，避免提醒评估时逐行重新加载
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        stocks = await run_in_threadpool(lambda: db.query(Stock).filter(Stock.auto_update == True).all())
+        stocks_by_market: Dict[str, List[Stock]] = {}
+        for stock in stocks:
+            stocks_by_market.setdefault(stock.market, []).append(stock)
+
+        updated, missing, failed_markets = [], 0, []
+        for market_type, market_stocks in stocks_by_market.items():
+            if market_type not in MARKET_SPOT_FETCHERS:
+                missing += len(market_stocks)
+                continue
+            try:
+                df = await run_in_threadpool(fetch_market_spot_frame, market_type)
+                quotes = _parse_market_frame(market_type, df)
+            except Exception as e:
+                logging.error(f"批量获取{market_type}行情失败: {e}")
+                failed_markets.append(market_type)
+                continue
+            now = datetime.now(timezone.utc)
+            for stock in market_stocks:
+                quote = quotes.get(stock.symbol)
+                # 停牌等情况行情表中价格为空或 0，保留库中原价，不当作新行情
+                if quote is None or not quote[1]:
+                    missing += 1
+                    continue
+                alert_state = alert_engine.capture(stock)
+                _, price, change = quote
+                # 只刷新价格类字段；PE 等估值字段由 update_watchlist_stocks 按数据源口径更新
+                stock.current_price = price
+                stock.change_percent = change
+                stock.last_updated = now
+                updated.append((stock, alert_state))
+
+        def commit_and_evaluate():
+            # 提交与提醒评估放在同一次线程池调用中，事件循环线程上不会发生任何查询
+            db.commit()
+            for stock, alert_state in updated:
+                alert_engine.evaluate(stock, alert_state)
+
+        await run_in_threadpool(commit_and_evaluate)
+
+        job_status["status"] = "失败" if failed_markets and not updated else "完成"
+        job_status["message"] = (f"批量行情刷新完成：更新 {len(updated)} 只，未匹配 {missing} 只"
+                                 + (f"，获取失败市场: {'、'.join(failed_markets)}" if failed_markets else ""))
+        job_status["progress"] = 100
+        logging.info(job_status["message"], extra={"job": "update_watchlist_quotes_bulk", "updated": len(updated),
+                                                   "missing": missing, "failed_markets": failed_markets})
+        await run_in_threadpool(market_snapshot.refresh)
+        await refresh_dashboard_snapshot()
+    except Exception as e:
+        await run_in_threadpool(lambda: db.rollback())
+        job_status["status"] = "失败"
+        job_status["message"] = f"批量刷新自选股行情失败: {e}"
+        job_status["progress"] = -1
+        logging.error(f"批量刷新自选股行情失败: {e}")
+    finally:
+        await run_in_threadpool(lambda: db.close())
+
 async def update_watchlist_stocks():
     db = SessionLocal()
+    started = time.perf_counter()
+    updated, no_data, failed = 0, 0, 0
     try:
         stocks = await run_in_threadpool(lambda: db.query(Stock).filter(Stock.auto_update == True).all())
         logging.info(f"开始定时更新 {len(stocks)} 只自选股票数据...")
 
         for stock in stocks:
             try:
-                market_data = await fetch_stock_data_akshare(stock.symbol, stock.market)
+                alert_state = alert_engine.capture(stock)
+                market_data = await fetch_stock_data_akshare(stock.symbol, stock.market, FUNDAMENTAL_QUOTE_FIELDS)
                 if market_data:
                     stock.current_price = market_data.get("current_price", stock.current_price)
                     stock.change_percent = market_data.get("change_percent", stock.change_percent)
@@ -599,12 +2376,23 @@ async def update_watchlist_stocks():
                 stock.last_updated = datetime.now(timezone.utc)
                 await run_in_threadpool(lambda: db.commit())
                 await run_in_threadpool(lambda: db.refresh(stock))
-                logging.info(f"股票 {stock.symbol} ({stock.market}) 数据更新成功。")
+                await run_in_threadpool(alert_engine.evaluate, stock, alert_state)
+                updated += 1
+                if not market_data:
+                    no_data += 1
             except Exception as e:
                 await run_in_threadpool(lambda: db.rollback())
-                logging.error(f"更新股票 {stock.symbol} ({stock.market}) 失败: {e}")
+                failed += 1
+                logging.error(f"更新股票 {stock.symbol} ({stock.market}) 失败: {e}", extra={"sample_key": "watchlist_update_error"})
         await run_in_threadpool(lambda: db.commit())
-        logging.info(f"定时更新完成，共更新 {len(stocks)} 只股票")
+        # 每只股票不再单独记录成功日志，整个任务只输出一条汇总记录
+        elapsed = round(time.perf_counter() - started, 3)
+        logging.info(f"定时更新完成，共 {len(stocks)} 只股票：更新 {updated} 只（其中 {no_data} 只未获取到新数据），"
+                     f"失败 {failed} 只，耗时 {elapsed}s",
+                     extra={"job": "update_watchlist_stocks", "total": len(stocks), "updated": updated,
+                            "no_data": no_data, "failed": failed, "elapsed_seconds": elapsed})
+        await run_in_threadpool(market_snapshot.refresh)  # 选股器用自选股基本面补齐缺失字段
+        await refresh_dashboard_snapshot()
 
     except Exception as e:
         await run_in_threadpool(lambda: db.rollback())
@@ -612,38 +2400,271 @@ async def update_watchlist_stocks():
     finally:
         await run_in_threadpool(lambda: db.close())
 
+# 数据库维护：保留期清理、增量 VACUUM、ANALYZE / PRAGMA optimize 与容量预算，在凌晨低峰期由调度主节点执行
+DB_MAINTENANCE_TIME = os.getenv("DB_MAINTENANCE_TIME", "04:30")
+WHOLE_MARKET_RETENTION_DAYS = int(os.getenv("WHOLE_MARKET_RETENTION_DAYS", 30))  # 非自选股从行情表消失超过该天数后删除
+DELETED_ROWS_RETENTION_DAYS = int(os.getenv("DELETED_ROWS_RETENTION_DAYS", 7))    # 增量同步墓碑保留天数
+JOB_STATUS_RETENTION_DAYS = int(os.getenv("JOB_STATUS_RETENTION_DAYS", 30))
+DB_SIZE_BUDGET_MB = float(os.getenv("DB_SIZE_BUDGET_MB", 0))                       # 0 表示不限制
+ROW_VERSION_FLOOR_KEY = "row_version_floor"
+
+background_job_status["db_maintenance"] = _idle_job_status("db_maintenance")
+
+# 热点查询及其期望使用的索引；执行计划出现全表扫描时视为不健康
+QUERY_PLAN_CHECKS = {
+    "whole_market_by_symbol": "SELECT id FROM whole_market_stocks WHERE symbol = 'x'",
+    "whole_market_changes": "SELECT id FROM whole_market_stocks WHERE row_version > 0 ORDER BY row_version LIMIT 100",
+    "stocks_by_symbol": "SELECT id FROM stocks WHERE symbol = 'x'",
+    "stocks_changes": "SELECT id FROM stocks WHERE row_version > 0 ORDER BY row_version LIMIT 100",
+    "deleted_rows_changes": "SELECT row_id FROM deleted_rows WHERE row_version > 0 ORDER BY row_version LIMIT 100",
+    "alert_rules_by_symbol": "SELECT id FROM alert_rules WHERE symbol = 'x'",
+}
+
+def database_stats(conn) -> Dict[str, Any]:
+    page_size = conn.execute(text("PRAGMA page_size")).scalar()
+    page_count = conn.execute(text("PRAGMA page_count")).scalar()
+    freelist = conn.execute(text("PRAGMA freelist_count")).scalar()
+    auto_vacuum = {0: "none", 1: "full", 2: "incremental"}.get(conn.execute(text("PRAGMA auto_vacuum")).scalar())
+    return {"size_bytes": page_size * page_count, "free_bytes": page_size * freelist, "auto_vacuum": auto_vacuum,
+            "size_budget_bytes": int(DB_SIZE_BUDGET_MB * 1024 * 1024) or None}
+
+def check_query_plans(conn) -> Dict[str, Any]:
+    plans = {}
+    for name, sql in QUERY_PLAN_CHECKS.items():
+        details = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        full_scan = any(d.startswith("SCAN") and "USING" not in d for d in details)
+        plans[name] = {"plan": details, "healthy": not full_scan and not any("TEMP B-TREE" in d for d in details)}
+    return {"healthy": all(p["healthy"] for p in plans.values()), "queries": plans}
+
+def _purge_whole_market_rows(db: Session, older_than: Optional[datetime]) -> int:
+    """删除从行情表消失（且不在自选股中）的全市场股票；bulk 删除不经过 flush 事件，需要手动写墓碑和递增版本"""
+    query = db.query(WholeMarketStock.id, WholeMarketStock.symbol, WholeMarketStock.market).filter(
+        WholeMarketStock.missing_since != None, WholeMarketStock.is_watchlist == False)
+    if older_than is not None:
+        query = query.filter(WholeMarketStock.missing_since < older_than)
+    rows = query.all()
+    if not rows:
+        return 0
+    next_version = allocate_row_versions(db, len(rows))
+    db.bulk_insert_mappings(DeletedRow, [
+        {"table_name": "whole_market_stocks", "row_id": row_id, "symbol": symbol, "market": market,
+         "row_version": next_version + offset, "deleted_at": datetime.now(timezone.utc)}
+        for offset, (row_id, symbol, market) in enumerate(rows)])
+    ids = [row_id for row_id, _, _ in rows]
+    for start in range(0, len(ids), BATCH_SIZE * 5):
+        db.query(WholeMarketStock).filter(WholeMarketStock.id.in_(ids[start:start + BATCH_SIZE * 5])) \
+            .delete(synchronize_session=False)
+    db.commit()
+    for market in {market for _, _, market in rows}:
+        bump_data_version("whole_market_stocks", market)
+    return len(rows)
+
+def _purge_tombstones(db: Session, older_than: Optional[datetime]) -> int:
+    """清理增量同步墓碑，并记录被清理的最大版本号：since 早于它的客户端无法得知这些删除，需要全量重新同步"""
+    query = db.query(DeletedRow)
+    if older_than is not None:
+        query = query.filter(DeletedRow.deleted_at < older_than)
+    floor = query.with_entities(func.max(DeletedRow.row_version)).scalar()
+    if floor is None:
+        return 0
+    purged = query.delete(synchronize_session=False)
+    db.execute(text("INSERT INTO data_versions (key, version) VALUES (:key, :floor) "
+                    "ON CONFLICT(key) DO UPDATE SET version = max(version, excluded.version)"),
+               {"key": ROW_VERSION_FLOOR_KEY, "floor": floor})
+    db.commit()
+    for table in VERSIONED_TABLES:
+        bump_data_version(table)  # 使缓存的 /changes 响应失效，让旧版本客户端收到 reset
+    return purged
+
+def _compact_database() -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            # 切换到增量模式需要一次完整 VACUUM 重建文件，之后每次只需归还空闲页
+            conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+        else:
+            # incremental_vacuum 每执行一步只归还一页，用 executescript 让 sqlite3 执行到结束
+            conn.connection.dbapi_connection.executescript("PRAGMA incremental_vacuum;")
+        conn.execute(text("ANALYZE"))
+        conn.execute(text("PRAGMA optimize"))
+
+def run_database_maintenance() -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    with engine.connect() as conn:
+        size_before = database_stats(conn)["size_bytes"]
+    deleted = {"whole_market_stocks": 0, "deleted_rows": 0, "job_status": 0}
+    db = SessionLocal()
+    try:
+        deleted["whole_market_stocks"] = _purge_whole_market_rows(db, now - timedelta(days=WHOLE_MARKET_RETENTION_DAYS))
+        deleted["deleted_rows"] = _purge_tombstones(db, now - timedelta(days=DELETED_ROWS_RETENTION_DAYS))
+        deleted["job_status"] = db.query(JobStatus).filter(
+            JobStatus.updated_at < time.time() - JOB_STATUS_RETENTION_DAYS * 86400).delete(synchronize_session=False)
+        db.commit()
+        _compact_database()
+
+        # 超出容量预算时放宽保留期：清除全部墓碑和所有已消失的非自选股，再次压缩
+        budget = int(DB_SIZE_BUDGET_MB * 1024 * 1024)
+        with engine.connect() as conn:
+            size_after = database_stats(conn)["size_bytes"]
+        budget_enforced = False
+        if budget and size_after > budget:
+            logging.warning(f"数据库大小 {size_after} 字节超出预算 {budget} 字节，执行强制清理")
+            deleted["whole_market_stocks"] += _purge_whole_market_rows(db, None)
+            deleted["deleted_rows"] += _purge_tombstones(db, None)
+            _compact_database()
+            budget_enforced = True
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    with engine.connect() as conn:
+        stats = database_stats(conn)
+        plans = check_query_plans(conn)
+    return {
+        **stats,
+        "size_before_bytes": size_before,
+        "bytes_reclaimed": size_before - stats["size_bytes"],
+        "deleted": deleted,
+        "budget_enforced": budget_enforced,
+        "over_budget": bool(budget and stats["size_bytes"] > budget),
+        "query_plans": plans,
+    }
+
+async def run_database_maintenance_job():
+    job_status = background_job_status["db_maintenance"]
+    job_status["status"] = "进行中"
+    job_status["message"] = "正在执行数据库维护..."
+    job_status["progress"] = 0
+    started = time.perf_counter()
+    try:
+        report = await run_in_threadpool(run_database_maintenance)
+        if any(report["deleted"].values()):
+            await run_in_threadpool(market_snapshot.refresh)
+            await refresh_dashboard_snapshot()
+        report["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+        job_status["report"] = report
+        job_status["status"] = "完成"
+        job_status["message"] = (f"数据库维护完成：回收 {report['bytes_reclaimed']} 字节，当前 {report['size_bytes']} 字节，"
+                                 f"删除 {report['deleted']}，查询计划{'正常' if report['query_plans']['healthy'] else '存在全表扫描'}")
+        job_status["progress"] = 100
+        logging.info(job_status["message"], extra={"job": "db_maintenance", "bytes_reclaimed": report["bytes_reclaimed"],
+                                                   "size_bytes": report["size_bytes"], "deleted": report["deleted"]})
+    except Exception as e:
+        job_status["status"] = "失败"
+        job_status["message"] = f"数据库维护失败: {e}"
+        job_status["progress"] = -1
+        logging.error(f"数据库维护失败: {e}")
+
+# 调度器选主：所有 worker 都维护 schedule，但只有持有 SQLite 租约的 worker 真正执行定时任务
+SCHEDULER_LEASE_NAME = "scheduler"
+SCHEDULER_LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", 90))
+SCHEDULER_HEARTBEAT_SECONDS = SCHEDULER_LEASE_SECONDS / 3
+scheduler_state = {"is_leader": False, "last_heartbeat": None}
+
+def try_acquire_lease(name: str, ttl: float) -> bool:
+    now = time.time()
+    params = {"name": name, "owner": WORKER_ID, "expires_at": now + ttl, "now": now}
+    with engine.begin() as conn:
+        conn.execute(text("INSERT OR IGNORE INTO scheduler_leases (name, owner, expires_at) "
+                          "VALUES (:name, :owner, :expires_at)"), params)
+        result = conn.execute(text("UPDATE scheduler_leases SET owner = :owner, expires_at = :expires_at "
+                                   "WHERE name = :name AND (owner = :owner OR expires_at < :now)"), params)
+        return result.rowcount == 1
+
+def release_lease(name: str):
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM scheduler_leases WHERE name = :name AND owner = :owner"),
+                     {"name": name, "owner": WORKER_ID})
+
+def run_leader_heartbeat():
+    while True:
+        try:
+            is_leader = try_acquire_lease(SCHEDULER_LEASE_NAME, SCHEDULER_LEASE_SECONDS)
+            if is_leader != scheduler_state["is_leader"]:
+                logging.info(f"worker {WORKER_ID} 调度主节点状态变更: {is_leader}")
+            scheduler_state["is_leader"] = is_leader
+            scheduler_state["last_heartbeat"] = datetime.now(timezone.utc).isoformat()
+        except Exception as e:
+            scheduler_state["is_leader"] = False
+            logging.error(f"调度器租约续期失败: {e}")
+        time.sleep(SCHEDULER_HEARTBEAT_SECONDS)
+
+def run_if_leader(job_name: str, job: Callable[[], Any]):
+    if not scheduler_state["is_leader"]:
+        logging.info(f"worker {WORKER_ID} 不是调度主节点，跳过定时任务 {job_name}")
+        return
+    asyncio.run(job())
+
+# 行情每小时批量刷新一次；逐只获取基本面的调用频率更低
+FUNDAMENTALS_REFRESH_HOURS = int(os.getenv("FUNDAMENTALS_REFRESH_HOURS", 24))
+
 def run_scheduler():
-    schedule.every(60).minutes.do(lambda: asyncio.run(update_watchlist_stocks()))  # 改为每60分钟
-    schedule.every().day.at("02:00").do(lambda: asyncio.run(update_full_market_data_overall()))
+    schedule.every(60).minutes.do(run_if_leader, "update_watchlist_quotes_bulk", update_watchlist_quotes_bulk)  # 改为每60分钟
+    schedule.every(FUNDAMENTALS_REFRESH_HOURS).hours.do(run_if_leader, "update_watchlist_stocks", update_watchlist_stocks)
+    schedule.every().day.at("02:00").do(run_if_leader, "update_full_market_data_overall", update_full_market_data_overall)
+    schedule.every().day.at("03:00").do(run_if_leader, "update_whole_market_fundamentals", update_whole_market_fundamentals)
+    schedule.every().day.at(DB_MAINTENANCE_TIME).do(run_if_leader, "run_database_maintenance_job", run_database_maintenance_job)
     while True:
         schedule.run_pending()
         time.sleep(120)  # 改为每2分钟检查一次
 
+# 服务开始接收请求后再在后台预热 provider 库，第一次数据拉取不必承担导入耗时
+PREWARM_PROVIDERS = os.getenv("PREWARM_PROVIDERS", "1") == "1"
+PREWARM_DELAY_SECONDS = float(os.getenv("PREWARM_DELAY_SECONDS", 1))
+
+def prewarm_provider_modules():
+    time.sleep(PREWARM_DELAY_SECONDS)
+    for module in (np, pd, ak):
+        try:
+            module.load()
+        except Exception as e:
+            logging.error(f"预热模块 {module._name} 失败: {e}")
+    logging.info(f"provider 库预热完成: {startup_report['lazy_imports']}")
+
 @app.on_event("startup")
 async def startup_event():
     logging.info("Backend startup event triggered.")
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+    startup_started = time.perf_counter()
+    init_database()
+    _sync_data_versions()
+    threading.Thread(target=run_data_version_sync, name="data-version-sync", daemon=True).start()
+    with startup_phase("scheduler"):
+        threading.Thread(target=run_leader_heartbeat, name="scheduler-heartbeat", daemon=True).start()
+        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+        scheduler_thread.start()
     logging.info("定时任务已启动")
     logging.info("定时任务调度器已启动，等待指定时间执行全市场股票基本信息自动更新任务。")
+    if HTTP_POOL_ENABLED:
+        shared_http.install()
+    threading.Thread(target=run_alert_dispatcher, name="alert-dispatcher", daemon=True).start()
+    if PREWARM_PROVIDERS:
+        threading.Thread(target=prewarm_provider_modules, name="provider-prewarm", daemon=True).start()
+    startup_report["phases"]["startup_event"] = round(time.perf_counter() - startup_started, 4)
+    startup_report["startup_complete_seconds"] = round(time.perf_counter() - _module_import_started, 4)
+    logging.info(f"启动耗时报告: {startup_report}")
 
 # API Routes
 @app.get("/")
 async def root():
     return {"message": "股票估值分析系统API", "version": "1.0.0"}
 
-@app.get("/stock_api/stocks", response_model=List[StockResponse])
-async def get_stocks(
-    response: Response, # Add Response here
-    skip: int = 0,
-    limit: int = 100,
-    search_query: Optional[str] = None, # Add search_query parameter
-    market: Optional[str] = None,       # Add market parameter
-    valuation_status: Optional[str] = None, # Add valuation_status parameter
-    db: Session = Depends(get_db)
-):
-    query = db.query(Stock)
+# 列表接口只查询响应需要的列，字段顺序与 StockResponse / WholeMarketStockResponse 一致
+STOCK_RESPONSE_COLUMNS = list(StockResponse.model_fields)
+WHOLE_MARKET_RESPONSE_COLUMNS = list(WholeMarketStockResponse.model_fields)
+RESPONSE_FORMATS = ("rows", "columnar")
+
+def _check_response_format(response_format: Optional[str]) -> str:
+    response_format = response_format or "rows"
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的响应格式: {response_format}")
+    return response_format
+
+VALUATION_STATUSES = ("低估", "合理", "高估", "数据缺失")
 
+def filter_stock_query(query, search_query: Optional[str] = None, market: Optional[str] = None,
+                       valuation_status: Optional[str] = None):
     if search_query:
         query = query.filter(Stock.name.contains(search_query) | Stock.symbol.contains(search_query))
 
@@ -662,16 +2683,351 @@ async def get_stocks(
             query = query.filter(Stock.current_pe == None, Stock.calculated_pe_lower == None, Stock.calculated_pe_upper == None)
         else:
             raise HTTPException(status_code=400, detail="无效的估值状态筛选器")
+    return query
 
-    total_stocks = await run_in_threadpool(lambda: query.count()) # Get total count
-    response.headers["X-Total-Count"] = str(total_stocks) # Set X-Total-Count header
+def filter_whole_market_query(query, market: Optional[str] = None, is_watchlist: Optional[bool] = None,
+                              search_query: Optional[str] = None):
+    if market:
+        query = query.filter(WholeMarketStock.market == market)
+    if is_watchlist is not None:
+        query = query.filter(WholeMarketStock.is_watchlist == is_watchlist)
+    if search_query:
+        query = query.filter(WholeMarketStock.name.contains(search_query) | WholeMarketStock.symbol.contains(search_query))
+    return query
 
-    stocks = await run_in_threadpool(lambda: query.order_by(Stock.last_updated.desc()).offset(skip).limit(limit).all())
-    return stocks
+@app.get("/stock_api/stocks", response_model=List[StockResponse])
+async def get_stocks(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    search_query: Optional[str] = None, # Add search_query parameter
+    market: Optional[str] = None,       # Add market parameter
+    valuation_status: Optional[str] = None, # Add valuation_status parameter
+    response_format: Optional[str] = Query(None, alias="format"), # rows（默认）或 columnar
+    db: Session = Depends(get_db)
+):
+    search_query = _normalize_search(search_query)
+    response_format = _check_response_format(response_format)
+    query = filter_stock_query(db.query(Stock), search_query, market, valuation_status)
+
+    def build():
+        total_stocks = query.count() # Get total count
+        rows = (query.with_entities(*[getattr(Stock, c) for c in STOCK_RESPONSE_COLUMNS])
+                .order_by(Stock.last_updated.desc()).offset(skip).limit(limit).all())
+        body = rows_to_json(STOCK_RESPONSE_COLUMNS, rows, response_format)
+        return body, {"X-Total-Count": str(total_stocks)} # Set X-Total-Count header
+
+    params = {"skip": skip, "limit": limit, "search_query": search_query,
+              "market": market, "valuation_status": valuation_status, "format": response_format}
+    return await serve_cached_json(request, "stocks", params, (get_data_version("stocks", market),), build)
+
+WHOLE_MARKET_SORT_FIELDS = {"symbol", "name", "market", "current_price", "change_percent", "last_updated", "is_watchlist", "id",
+                            "current_pe", "roe", "market_cap", "book_value_per_share"}
+
+# 选股器可用字段：数值字段支持比较/区间/空值判断，也可以与另一个数值字段比较（ref）
+SCREENER_FUNDAMENTAL_FIELDS = ("current_pe", "eps", "roe", "book_value_per_share", "market_cap",
+                               "calculated_pe_lower", "calculated_pe_mid", "calculated_pe_upper",
+                               "theoretical_price_lower", "theoretical_price_mid", "theoretical_price_upper")
+SCREENER_NUMERIC_FIELDS = ("current_price", "change_percent") + SCREENER_FUNDAMENTAL_FIELDS
+SCREENER_TEXT_FIELDS = ("symbol", "name", "market", "valuation_status")
+SCREENER_MAX_NODES = 64
+
+# 全市场只读快照：whole_market_stocks 只在入库时变化，读请求直接在内存列数组上筛选、排序、分页。
+# 入库/刷新任务结束时显式重建；读请求只返回当前快照，数据版本落后（如其他 worker 写入）且距上次构建
+# 超过 MARKET_SNAPSHOT_MAX_STALENESS_SECONDS 时在后台线程重建，请求本身从不等待重建
+MARKET_SNAPSHOT_ENABLED = os.getenv("MARKET_SNAPSHOT", "1") == "1"
+MARKET_SNAPSHOT_MAX_STALENESS_SECONDS = float(os.getenv("MARKET_SNAPSHOT_MAX_STALENESS_SECONDS", 60))
+
+class MarketSnapshot:
+    """whole_market_stocks 的列式快照，价格/涨跌幅为 NumPy 数组，并为每个可排序字段预先计算升序排列"""
+
+    def __init__(self, version: Tuple, rows: List[Tuple], fundamentals: Optional[Dict[str, Tuple]] = None):
+        data = dict(zip(WHOLE_MARKET_RESPONSE_COLUMNS, zip(*rows))) if rows else \
+            {c: () for c in WHOLE_MARKET_RESPONSE_COLUMNS}
+        self.version = version
+        self.size = len(rows)
+        self.ids = np.array(data["id"], dtype=np.int64)
+        self.symbols = np.array([sys.intern(v) for v in data["symbol"]], dtype=object)
+        self.names = np.array([sys.intern(v or "") for v in data["name"]], dtype=object)
+        self.market_labels = sorted(set(data["market"]))
+        market_index = {m: i for i, m in enumerate(self.market_labels)}
+        self.market_codes = np.array([market_index[m] for m in data["market"]], dtype=np.int16)
+        self.current_price = np.array([np.nan if v is None else v for v in data["current_price"]], dtype=np.float64)
+        self.change_percent = np.array([np.nan if v is None else v for v in data["change_percent"]], dtype=np.float64)
+        self.last_updated = np.array(data["last_updated"], dtype=object)
+        self.is_watchlist = np.array([bool(v) for v in data["is_watchlist"]], dtype=bool)
+        self.search_text = [f"{sym}\x00{name}".lower() for sym, name in zip(data["symbol"], data["name"])]
+        self._build_screener_columns(data, fundamentals or {})
+        self.sort_orders = {field: self._ascending_order(field) for field in WHOLE_MARKET_SORT_FIELDS}
+
+    def _build_screener_columns(self, data: Dict[str, Tuple], fundamentals: Dict[str, Tuple]):
+        """table_numeric 为全市场表原值，列表接口只返回这些值，与 SQL 路径一致；
+        选股器使用的 numeric 在批量基本面缺失时用自选股表中逐只获取的数据补齐，仍缺失为 NaN"""
+        self.table_numeric = {"current_price": self.current_price, "change_percent": self.change_percent}
+        self.numeric = dict(self.table_numeric)
+        self.table_valuation_status = np.array(data["valuation_status"], dtype=object)
+        joined = [fundamentals.get(symbol) for symbol in data["symbol"]]
+        for i, field in enumerate(SCREENER_FUNDAMENTAL_FIELDS):
+            self.table_numeric[field] = np.array([np.nan if value is None else value for value in data[field]],
+                                                 dtype=np.float64)
+            self.numeric[field] = np.array(
+                [np.nan if value is None and (row is None or row[i] is None) else (row[i] if value is None else value)
+                 for value, row in zip(data[field], joined)], dtype=np.float64)
+        pe = self.numeric["current_pe"]
+        lower, upper = self.numeric["calculated_pe_lower"], self.numeric["calculated_pe_upper"]
+        missing = np.isnan(pe) | np.isnan(lower) | np.isnan(upper)
+        with np.errstate(invalid="ignore"):
+            self.valuation_status = np.select(
+                [missing, pe < lower, pe > upper], ["数据缺失", "低估", "高估"], default="合理").astype(object)
+        self.text = {
+            "symbol": self.symbols,
+            "name": self.names,
+            "market": np.array(self.market_labels, dtype=object)[self.market_codes] if self.size
+            else np.array([], dtype=object),
+            "valuation_status": self.valuation_status,
+        }
+
+    def screen(self, mask, sort_field: Optional[str], sort_order: str, skip: int, limit: int) -> Tuple[int, List[Dict]]:
+        selected = np.flatnonzero(mask)
+        if sort_field:
+            values = self.numeric[sort_field][selected]
+            if sort_order == "desc":
+                values = -values
+            # NaN 无论升降序都排在最后
+            selected = selected[np.argsort(values, kind="stable")]
+        page = selected[max(skip, 0):max(skip, 0) + max(limit, 0)]
+        columns = {"id": self.ids[page].tolist(), **{f: self.text[f][page].tolist() for f in SCREENER_TEXT_FIELDS}}
+        for field, values in self.numeric.items():
+            columns[field] = [None if v != v else v for v in values[page].tolist()]
+        items = [dict(zip(columns, row)) for row in zip(*columns.values())]
+        return len(selected), items
+
+    def _ascending_order(self, field: str):
+        if field in self.table_numeric:
+            values = self.table_numeric[field]
+            missing = np.isnan(values)
+            # 与 SQLite 一致：升序时 NULL 排在最前，降序时排在最后
+            present = np.flatnonzero(~missing)
+            return np.concatenate([np.flatnonzero(missing), present[np.argsort(values[present], kind="stable")]])
+        if field == "last_updated":
+            keys = np.array([v.timestamp() if v is not None else -np.inf for v in self.last_updated], dtype=np.float64)
+            return np.argsort(keys, kind="stable")
+        if field == "market":
+            return np.argsort(self.market_codes, kind="stable")  # market_labels 已排序，编码顺序即字符串顺序
+        values = {"id": self.ids, "symbol": self.symbols, "name": self.names, "is_watchlist": self.is_watchlist}[field]
+        return np.argsort(values, kind="stable")
+
+    def query(self, market: Optional[str] = None, is_watchlist: Optional[bool] = None,
+              search_query: Optional[str] = None, sort_field: Optional[str] = None,
+              sort_order: Optional[str] = None, skip: int = 0, limit: int = 100) -> Tuple[int, List[Tuple]]:
+        mask = None
+        if market:
+            if market not in self.market_labels:
+                return 0, []
+            mask = self.market_codes == self.market_labels.index(market)
+        if is_watchlist is not None:
+            watch_mask = self.is_watchlist == is_watchlist
+            mask = watch_mask if mask is None else mask & watch_mask
+        if search_query:
+            needle = search_query.lower()
+            search_mask = np.fromiter((needle in text for text in self.search_text), dtype=bool, count=self.size)
+            mask = search_mask if mask is None else mask & search_mask
+
+        if sort_field:
+            order = self.sort_orders[sort_field]
+            if sort_order == "desc":
+                order = order[::-1]
+        else:
+            order = self.sort_orders["last_updated"][::-1]
+        selected = order if mask is None else order[mask[order]]
+        page = selected[max(skip, 0):max(skip, 0) + max(limit, 0)]
+        return len(selected), self._rows(page)
+
+    def _rows(self, page) -> List[Tuple]:
+        columns = {
+            "id": self.ids[page].tolist(),
+            "last_updated": self.last_updated[page].tolist(),
+            "is_watchlist": self.is_watchlist[page].tolist(),
+            **{field: values[page].tolist() for field, values in self.text.items()},
+            "valuation_status": self.table_valuation_status[page].tolist(),
+        }
+        for field, values in self.table_numeric.items():
+            columns[field] = [None if v != v else v for v in values[page].tolist()]
+        # 字段顺序与 WHOLE_MARKET_RESPONSE_COLUMNS 保持一致
+        return list(zip(*(columns[c] for c in WHOLE_MARKET_RESPONSE_COLUMNS)))
+
+class MarketSnapshotStore:
+    """持有当前快照；重建时在锁内构建新快照并整体替换引用（copy-on-write），读请求不加锁。
+    入库过程中每个批次提交都会改变数据版本，读请求不跟随重建，继续使用上一份快照"""
+
+    def __init__(self):
+        self._snapshot: Optional[MarketSnapshot] = None
+        self._lock = threading.Lock()
+        self._background_rebuild = False
+        self._built_at = 0.0
+        self.last_build_seconds: Optional[float] = None
+
+    @staticmethod
+    def _data_version() -> Tuple:
+        return (get_data_version("whole_market_stocks"), get_data_version("stocks"))
+
+    def get(self) -> MarketSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.refresh()  # 进程内第一次读取只能同步构建
+        if (snapshot.version != self._data_version() and not self._background_rebuild
+                and time.monotonic() - self._built_at >= MARKET_SNAPSHOT_MAX_STALENESS_SECONDS):
+            self._background_rebuild = True
+            threading.Thread(target=self._rebuild_in_background, name="market-snapshot-rebuild", daemon=True).start()
+        return snapshot
+
+    def _rebuild_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logging.error(f"后台重建全市场快照失败: {e}")
+        finally:
+            self._background_rebuild = False
+
+    def refresh(self) -> MarketSnapshot:
+        """任务写入完成后调用：版本变化时重建，并发调用在锁内复查版本，只构建一次"""
+        with self._lock:
+            version = self._data_version()
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._build(version)
+                self._snapshot = snapshot
+                self._built_at = time.monotonic()
+        return snapshot
+
+    def _build(self, version: Tuple) -> MarketSnapshot:
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            rows = db.query(*[getattr(WholeMarketStock, c) for c in WHOLE_MARKET_RESPONSE_COLUMNS]).all()
+            stock_columns = {**{f: getattr(Stock, f, None) for f in SCREENER_FUNDAMENTAL_FIELDS},
+                             "eps": (Stock.book_value_per_share * Stock.roe).label("eps")}
+            fundamentals = {row[0]: row[1:] for row in db.query(
+                Stock.symbol, *[stock_columns[f] for f in SCREENER_FUNDAMENTAL_FIELDS])}
+        finally:
+            db.close()
+        snapshot = MarketSnapshot(version, rows, fundamentals)
+        self.last_build_seconds = round(time.perf_counter() - started, 4)
+        logging.info(f"全市场快照已重建: {snapshot.size} 只股票，耗时 {self.last_build_seconds}s")
+        return snapshot
+
+market_snapshot = MarketSnapshotStore()
+
+async def refresh_market_snapshot():
+    """自选状态等单行写入后作为后台任务调用，不阻塞接口响应"""
+    try:
+        await run_in_threadpool(market_snapshot.refresh)
+    except Exception as e:
+        logging.error(f"重建全市场快照失败: {e}")
+
+class ScreenerRequest(BaseModel):
+    filter: Optional[Dict[str, Any]] = None
+    sort_field: Optional[str] = None
+    sort_order: str = "desc"
+    skip: int = 0
+    limit: int = 50
+
+def compile_screener_filter(snapshot: MarketSnapshot, node: Optional[Dict[str, Any]], budget: List[int]):
+    """把筛选表达式编译为布尔掩码。表达式为嵌套字典：
+    {"all": [...]} / {"any": [...]} / {"not": {...}} 组合条件，
+    {"field": "current_pe", "op": "<", "value": 15} 或 {"field": "current_price", "op": "<", "ref": "theoretical_price_mid"} 为单个条件"""
+    if node is None:
+        return np.ones(snapshot.size, dtype=bool)
+    budget[0] -= 1
+    if budget[0] < 0:
+        raise ValueError(f"筛选表达式过于复杂，最多 {SCREENER_MAX_NODES} 个节点")
+    if not isinstance(node, dict):
+        raise ValueError("筛选表达式节点必须是对象")
+    # 每个节点只能是一种：all / any / not 组合，或 field 条件；混用时其余键会被静默忽略，直接拒绝
+    kinds = [key for key in ("all", "any", "not", "field") if key in node]
+    if len(kinds) != 1:
+        raise ValueError(f"筛选表达式节点必须且只能包含 all、any、not、field 之一，当前为: {', '.join(kinds) or '无'}")
+    if "all" in node or "any" in node:
+        children = node.get("all", node.get("any"))
+        if not isinstance(children, list) or not children:
+            raise ValueError("all/any 需要非空数组")
+        masks = [compile_screener_filter(snapshot, child, budget) for child in children]
+        return np.logical_and.reduce(masks) if "all" in node else np.logical_or.reduce(masks)
+    if "not" in node:
+        return ~compile_screener_filter(snapshot, node["not"], budget)
+
+    field, op = node.get("field"), node.get("op")
+    if field in SCREENER_NUMERIC_FIELDS:
+        values = snapshot.numeric[field]
+        if op == "is_null":
+            return np.isnan(values)
+        if op == "not_null":
+            return ~np.isnan(values)
+        if "ref" in node:
+            if node["ref"] not in SCREENER_NUMERIC_FIELDS:
+                raise ValueError(f"不支持的比较字段: {node['ref']}")
+            operand = snapshot.numeric[node["ref"]]
+        elif op == "between":
+            bounds = node.get("value")
+            if not isinstance(bounds, list) or len(bounds) != 2:
+                raise ValueError("between 需要 [下限, 上限]")
+            try:
+                low, high = float(bounds[0]), float(bounds[1])
+            except (TypeError, ValueError):
+                raise ValueError("between 的上下限必须是数字")
+            with np.errstate(invalid="ignore"):
+                return (values >= low) & (values <= high)
+        else:
+            try:
+                operand = float(node.get("value"))
+            except (TypeError, ValueError):
+                raise ValueError(f"字段 {field} 的比较值必须是数字")
+        comparisons = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+                       "==": np.equal, "!=": np.not_equal}
+        if op not in comparisons:
+            raise ValueError(f"数值字段不支持操作符: {op}")
+        with np.errstate(invalid="ignore"):
+            return comparisons[op](values, operand)
+    if field in SCREENER_TEXT_FIELDS:
+        values = snapshot.text[field]
+        value = node.get("value")
+        if op == "==":
+            return values == value
+        if op == "!=":
+            return values != value
+        if op == "in":
+            if not isinstance(value, list):
+                raise ValueError("in 需要数组")
+            return np.isin(values, value)
+        if op == "contains":
+            needle = str(value).lower()
+            return np.fromiter((needle in str(v).lower() for v in values), dtype=bool, count=snapshot.size)
+        raise ValueError(f"文本字段不支持操作符: {op}")
+    raise ValueError(f"不支持的筛选字段: {field}")
+
+@app.post("/stock_api/screener")
+async def run_screener(request: Request, screener: ScreenerRequest):
+    if screener.sort_field and screener.sort_field not in SCREENER_NUMERIC_FIELDS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序字段: {screener.sort_field}")
+    snapshot = await run_in_threadpool(market_snapshot.get)
+
+    def build():
+        started = time.perf_counter()
+        try:
+            mask = compile_screener_filter(snapshot, screener.filter, [SCREENER_MAX_NODES])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        total, items = snapshot.screen(mask, screener.sort_field, screener.sort_order,
+                                       screener.skip, min(screener.limit, 1000))
+        return dumps_json({"total": total, "items": items,
+                           "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)}), {"X-Total-Count": str(total)}
+
+    params = {"body": json.dumps(screener.model_dump(), sort_keys=True, ensure_ascii=False)}
+    return await serve_cached_json(request, "screener", params, snapshot.version, build)
 
 @app.get("/stock_api/whole_market_stocks", response_model=List[WholeMarketStockResponse])
 async def get_whole_market_stocks(
-    response: Response,
+    request: Request,
     skip: int = 0,
     limit: int = 100,
     market: Optional[str] = None,
@@ -679,29 +3035,244 @@ async def get_whole_market_stocks(
     search_query: Optional[str] = None,
     sort_field: Optional[str] = None,
     sort_order: Optional[str] = None,
+    response_format: Optional[str] = Query(None, alias="format"), # rows（默认）或 columnar
     db: Session = Depends(get_db)
 ):
-    query = db.query(WholeMarketStock)
-    if market:
-        query = query.filter(WholeMarketStock.market == market)
-    if is_watchlist is not None:
-        query = query.filter(WholeMarketStock.is_watchlist == is_watchlist)
-    if search_query:
-        query = query.filter(WholeMarketStock.name.contains(search_query) | WholeMarketStock.symbol.contains(search_query))
+    search_query = _normalize_search(search_query)
+    response_format = _check_response_format(response_format)
+    if sort_field and sort_field not in WHOLE_MARKET_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序字段: {sort_field}")
+    sort_order = "desc" if sort_order == "desc" else "asc"
 
-    total_stocks = await run_in_threadpool(lambda: query.count())
-    response.headers["X-Total-Count"] = str(total_stocks)
+    query = filter_whole_market_query(db.query(WholeMarketStock), market, is_watchlist, search_query)
 
     if sort_field:
         if sort_order == "desc":
-            query = query.order_by(getattr(WholeMarketStock, sort_field).desc())
+            ordered = query.order_by(getattr(WholeMarketStock, sort_field).desc())
         else:
-            query = query.order_by(getattr(WholeMarketStock, sort_field).asc())
+            ordered = query.order_by(getattr(WholeMarketStock, sort_field).asc())
     else:
-        query = query.order_by(WholeMarketStock.last_updated.desc())
+        ordered = query.order_by(WholeMarketStock.last_updated.desc())
+
+    snapshot = await run_in_threadpool(market_snapshot.get) if MARKET_SNAPSHOT_ENABLED else None
+
+    def build():
+        if snapshot is not None:
+            total_stocks, rows = snapshot.query(
+                market, is_watchlist, search_query, sort_field, sort_order, skip, limit)
+            return rows_to_json(WHOLE_MARKET_RESPONSE_COLUMNS, rows, response_format), {"X-Total-Count": str(total_stocks)}
+        total_stocks = query.count()
+        rows = (ordered.with_entities(*[getattr(WholeMarketStock, c) for c in WHOLE_MARKET_RESPONSE_COLUMNS])
+                .offset(skip).limit(limit).all())
+        body = rows_to_json(WHOLE_MARKET_RESPONSE_COLUMNS, rows, response_format)
+        return body, {"X-Total-Count": str(total_stocks)}
+
+    params = {"skip": skip, "limit": limit, "market": market, "is_watchlist": is_watchlist,
+              "search_query": search_query, "sort_field": sort_field, "sort_order": sort_order,
+              "format": response_format}
+    # 走快照时响应取决于快照而不是最新数据版本，缓存键使用快照自身的版本
+    version = snapshot.version if snapshot is not None else (get_data_version("whole_market_stocks", market),)
+    return await serve_cached_json(request, "whole_market_stocks", params, version, build)
+
+# 增量同步：客户端保存上次返回的 version，下次以 since=version 只拉取之后写入或删除的行
+CHANGES_TABLES = {
+    "stocks": (Stock, STOCK_RESPONSE_COLUMNS),
+    "whole_market_stocks": (WholeMarketStock, WHOLE_MARKET_RESPONSE_COLUMNS),
+}
+CHANGES_MAX_LIMIT = 5000
+
+def _read_changes(table: str, since: int, limit: int) -> Dict[str, Any]:
+    model, columns = CHANGES_TABLES[table]
+    db = SessionLocal()
+    try:
+        # 先读取高水位，只返回不超过它的版本，读取期间新提交的写入留到下一次同步
+        high_water = current_row_version(db.connection())
+        floor = db.execute(text("SELECT version FROM data_versions WHERE key = :key"),
+                           {"key": ROW_VERSION_FLOOR_KEY}).scalar() or 0
+        if 0 < since < floor:
+            # 该版本之后的部分删除记录已被清理，客户端需要丢弃本地副本并从 since=0 重新同步
+            return {"table": table, "since": since, "version": high_water, "has_more": False, "reset": True,
+                    "upserts": [], "deletes": []}
+        upserts = (db.query(*[getattr(model, c) for c in columns], model.row_version)
+                   .filter(model.row_version > since, model.row_version <= high_water)
+                   .order_by(model.row_version).limit(limit + 1).all())
+        deletes = (db.query(DeletedRow.row_id, DeletedRow.symbol, DeletedRow.market, DeletedRow.row_version)
+                   .filter(DeletedRow.table_name == table, DeletedRow.row_version > since,
+                           DeletedRow.row_version <= high_water)
+                   .order_by(DeletedRow.row_version).limit(limit + 1).all())
+    finally:
+        db.close()
 
-    whole_market_stocks = await run_in_threadpool(lambda: query.offset(skip).limit(limit).all())
-    return whole_market_stocks
+    # 每行的版本号唯一，按版本合并后截断，下一页从本页最后一个版本继续
+    changes = sorted([(row[-1], "upsert", row) for row in upserts] + [(row[-1], "delete", row) for row in deletes],
+                     key=lambda change: change[0])
+    has_more = len(changes) > limit
+    page = changes[:limit]
+    version = page[-1][0] if has_more else max(high_water, since)
+    return {
+        "table": table,
+        "since": since,
+        "version": version,
+        "has_more": has_more,
+        "reset": False,
+        "upserts": [dict(zip(columns + ["row_version"], row)) for _, kind, row in page if kind == "upsert"],
+        "deletes": [{"id": row[0], "symbol": row[1], "market": row[2], "row_version": row[3]}
+                    for _, kind, row in page if kind == "delete"],
+    }
+
+@app.get("/stock_api/changes")
+async def get_changes(request: Request, since: int = 0, table: str = "whole_market_stocks", limit: int = 1000):
+    if table not in CHANGES_TABLES:
+        raise HTTPException(status_code=400, detail=f"不支持的表: {table}")
+    if since < 0 or limit <= 0:
+        raise HTTPException(status_code=400, detail="since 不能为负数，limit 必须为正数")
+    limit = min(limit, CHANGES_MAX_LIMIT)
+
+    def build():
+        changes = _read_changes(table, since, limit)
+        return dumps_json(changes), {"X-Data-Version": str(changes["version"])}
+
+    params = {"table": table, "since": since, "limit": limit}
+    return await serve_cached_json(request, "changes", params, (get_data_version(table),), build)
+
+# 导出：按主键分页逐块读取，每次只在内存中保留一个分块
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 2000))
+EXPORT_FORMATS = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+def iter_query_chunks(model, columns: List[str], apply_filters: Callable, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """每个分块是一次独立的短查询（id > 上一块最后的 id），读完立即释放连接。
+    下载再慢也不会长时间持有 SQLite 共享锁而阻塞入库任务的提交"""
+    last_id = 0
+    while True:
+        db = SessionLocal()
+        try:
+            rows = (apply_filters(db.query(model.id, *[getattr(model, c) for c in columns]))
+                    .filter(model.id > last_id).order_by(model.id).limit(chunk_size).all())
+        finally:
+            db.close()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [tuple(row[1:]) for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+def iter_csv_export(columns: List[str], chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM，保证 Excel 正确识别中文
+    writer.writerow(columns)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink:
+    """供 ParquetWriter 写入的文件对象，写入的字节在每个 row group 之后被取走"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+def _arrow_type(pa, column):
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+def iter_parquet_export(model, columns: List[str], chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(c, _arrow_type(pa, model.__table__.c[c])) for c in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for chunk in chunks:
+            column_values = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(column_values, schema)], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def export_response(model, columns: List[str], apply_filters: Callable, export_format: str, filename: str):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {export_format}")
+    chunks = iter_query_chunks(model, columns, apply_filters)
+    if export_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=400, detail="导出 Parquet 需要安装 pyarrow")
+        content = iter_parquet_export(model, columns, chunks)
+    else:
+        content = iter_csv_export(columns, chunks)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return StreamingResponse(content, media_type=EXPORT_FORMATS[export_format], headers={
+        "Content-Disposition": f'attachment; filename="{filename}_{stamp}.{export_format}"'})
+
+@app.get("/stock_api/export/whole_market_stocks")
+async def export_whole_market_stocks(
+    export_format: str = Query("csv", alias="format"),
+    market: Optional[str] = None,
+    is_watchlist: Optional[bool] = None,
+    search_query: Optional[str] = None,
+):
+    search_query = _normalize_search(search_query)
+    return export_response(
+        WholeMarketStock, WHOLE_MARKET_RESPONSE_COLUMNS,
+        lambda query: filter_whole_market_query(query, market, is_watchlist, search_query),
+        export_format, "whole_market_stocks")
+
+@app.get("/stock_api/export/stocks")
+async def export_stocks(
+    export_format: str = Query("csv", alias="format"),
+    search_query: Optional[str] = None,
+    market: Optional[str] = None,
+    valuation_status: Optional[str] = None,
+):
+    search_query = _normalize_search(search_query)
+    # 先校验筛选参数，避免在开始流式输出后才报错
+    if valuation_status and valuation_status not in VALUATION_STATUSES:
+        raise HTTPException(status_code=400, detail="无效的估值状态筛选器")
+    return export_response(
+        Stock, STOCK_RESPONSE_COLUMNS,
+        lambda query: filter_stock_query(query, search_query, market, valuation_status),
+        export_format, "stocks")
 
 @app.put("/stock_api/whole_market_stocks/{symbol}/watchlist", response_model=WholeMarketStockResponse)
 async def update_stock_watchlist_status(
@@ -740,6 +3311,7 @@ async def update_stock_watchlist_status(
             if stock_to_delete:
                 await run_in_threadpool(lambda: db.delete(stock_to_delete))
                 await run_in_threadpool(lambda: db.commit())
+        background_tasks.add_task(refresh_market_snapshot)
 
         return whole_market_stock
     except Exception as e:
@@ -793,7 +3365,7 @@ async def create_stock(stock: StockCreate, background_tasks: BackgroundTasks, db
     return {"message": f"股票 {db_stock.symbol} ({db_stock.market}) 添加成功，后台数据更新中。", **StockResponse.model_validate(db_stock).model_dump()}
 
 @app.delete("/stock_api/stocks/{symbol}")
-async def delete_stock(symbol: str, db: Session = Depends(get_db)):
+async def delete_stock(symbol: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     db_stock = await run_in_threadpool(lambda: db.query(Stock).filter(Stock.symbol == symbol).first())
     if not db_stock:
         raise HTTPException(status_code=404, detail="股票不存在")
@@ -805,6 +3377,7 @@ async def delete_stock(symbol: str, db: Session = Depends(get_db)):
 
     await run_in_threadpool(lambda: db.delete(db_stock))
     await run_in_threadpool(lambda: db.commit())
+    background_tasks.add_task(refresh_market_snapshot)
     return {"message": "删除成功"}
 
 @app.post("/stock_api/stocks/batch", response_model=Dict[str, Any])
@@ -864,16 +3437,18 @@ async def update_stock_data_for_symbols(symbols: List[str], markets: List[str],
         for symbol, market in zip(symbols, markets):
             stock = await run_in_threadpool(lambda: db.query(Stock).filter(Stock.symbol == symbol, Stock.market == market).first())
             if stock:
+                alert_state = alert_engine.capture(stock)
                 market_data = await fetch_stock_data_akshare(stock.symbol, stock.market)
                 if market_data:
-                    stock.current_price = market_data.get("current_price")
-                    stock.change_percent = market_data.get("change_percent")
-                    stock.volume = market_data.get("volume")
-                    stock.market_cap = market_data.get("market_cap")
+                    # 备用数据源只返回价格类字段，缺失的字段保留原值
+                    stock.current_price = market_data.get("current_price", stock.current_price)
+                    stock.change_percent = market_data.get("change_percent", stock.change_percent)
+                    stock.volume = market_data.get("volume", stock.volume)
+                    stock.market_cap = market_data.get("market_cap", stock.market_cap)
                     stock.name = market_data.get("name", stock.name)
-                    stock.current_pe = market_data.get("current_pe")
-                    stock.roe = market_data.get("roe")
-                    stock.book_value_per_share = market_data.get("book_value_per_share")
+                    stock.current_pe = market_data.get("current_pe", stock.current_pe)
+                    stock.roe = market_data.get("roe", stock.roe)
+                    stock.book_value_per_share = market_data.get("book_value_per_share", stock.book_value_per_share)
 
                 if all([stock.book_value_per_share is not None, stock.roe is not None,
                        stock.perpetual_growth_rate is not None, stock.required_return_rate is not None]):
@@ -894,8 +3469,11 @@ async def update_stock_data_for_symbols(symbols: List[str], markets: List[str],
                 stock.last_updated = datetime.now(timezone.utc)
                 await run_in_threadpool(lambda: db.commit())
                 await run_in_threadpool(lambda: db.refresh(stock))
+                await run_in_threadpool(alert_engine.evaluate, stock, alert_state)
             else:
-                logging.warning(f"未找到股票 {symbol} ({market}) 进行更新。")
+                logging.warning(f"未找到股票 {symbol} ({market}) 进行更新。", extra={"sample_key": "watchlist_missing"})
+        await refresh_market_snapshot()
+        await refresh_dashboard_snapshot()
     except Exception as e:
         logging.error(f"批量特定股票更新失败: {e}")
     # finally:
@@ -912,9 +3490,15 @@ async def calculate_valuation_api(request: ValuationRequest):
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/stock_api/analysis/screening")
-async def screening_analysis(db: Session = Depends(get_db)):
-    stocks = await run_in_threadpool(lambda: db.query(Stock).all())
+async def screening_analysis(request: Request, db: Session = Depends(get_db)):
+    def build():
+        stocks = db.query(Stock).all()
+        result = _build_screening_result(stocks)
+        return dumps_json(result), {}
+
+    return await serve_cached_json(request, "analysis/screening", {}, (get_data_version("stocks"),), build)
 
+def _build_screening_result(stocks: List[Stock]) -> Dict[str, Any]:
     total = len(stocks)
     overvalued = 0
     undervalued = 0
@@ -957,14 +3541,218 @@ async def screening_analysis(db: Session = Depends(get_db)):
         ]
     }
 
+# 仪表盘快照：刷新任务结束时统一计算并序列化一次，读请求直接返回现成的字节串，
+# 成本与自选股数量和并发访问量无关；其他写入使数据版本变化后在下一次读取时惰性重建
+DASHBOARD_TOP_N = int(os.getenv("DASHBOARD_TOP_N", 10))
+VALUATION_BUCKETS = {"低估": "undervalued", "合理": "reasonable", "高估": "overvalued", "数据缺失": "unknown"}
+
+def _empty_buckets() -> Dict[str, int]:
+    return {"total": 0, **{bucket: 0 for bucket in VALUATION_BUCKETS.values()}}
+
+def build_dashboard_data() -> Dict[str, Any]:
+    db = SessionLocal()
+    try:
+        rows = db.query(*[getattr(Stock, c) for c in STOCK_RESPONSE_COLUMNS]).all()
+        whole_market_rows = db.query(WholeMarketStock.market, WholeMarketStock.valuation_status,
+                                     func.count(WholeMarketStock.id), func.max(WholeMarketStock.last_updated)
+                                     ).group_by(WholeMarketStock.market, WholeMarketStock.valuation_status).all()
+    finally:
+        db.close()
+
+    stocks = [dict(zip(STOCK_RESPONSE_COLUMNS, row)) for row in rows]
+    totals, by_market = _empty_buckets(), {}
+    for stock in stocks:
+        stock["valuation_status"] = valuation_status_of(
+            stock["current_pe"], stock["calculated_pe_lower"], stock["calculated_pe_upper"])
+        bucket = VALUATION_BUCKETS[stock["valuation_status"]]
+        market_counts = by_market.setdefault(stock["market"], _empty_buckets())
+        for counts in (totals, market_counts):
+            counts["total"] += 1
+            counts[bucket] += 1
+
+    undervalued = [s for s in stocks if s["valuation_status"] == "低估" and s["calculated_pe_lower"]]
+    overvalued = [s for s in stocks if s["valuation_status"] == "高估" and s["calculated_pe_upper"]]
+    movers = [s for s in stocks if s["change_percent"] is not None]
+    epoch = datetime.min.replace(tzinfo=timezone.utc)
+
+    def updated_at(stock):
+        value = stock["last_updated"]
+        return epoch if value is None else value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+    whole_market: Dict[str, Dict[str, Any]] = {}
+    for market, status, count, last_updated in whole_market_rows:
+        counts = whole_market.setdefault(market, {**_empty_buckets(), "last_updated": None})
+        counts["total"] += count
+        counts[VALUATION_BUCKETS.get(status, "unknown")] += count
+        if last_updated is not None and (counts["last_updated"] is None or last_updated > counts["last_updated"]):
+            counts["last_updated"] = last_updated
+
+    latest = max(stocks, key=updated_at)["last_updated"] if stocks else None
+    return {
+        # 前五个字段与 /analysis/screening 一致
+        **totals,
+        "by_market": by_market,
+        # 按当前 PE 偏离合理区间边界的比例排序
+        "top_undervalued": sorted(undervalued, key=lambda s: s["current_pe"] / s["calculated_pe_lower"])[:DASHBOARD_TOP_N],
+        "top_overvalued": sorted(overvalued, key=lambda s: s["current_pe"] / s["calculated_pe_upper"],
+                                 reverse=True)[:DASHBOARD_TOP_N],
+        "recent_movers": sorted(movers, key=lambda s: abs(s["change_percent"]), reverse=True)[:DASHBOARD_TOP_N],
+        # 与 /stocks?skip=0&limit=10 相同：最近更新的自选股
+        "recent_stocks": sorted(stocks, key=updated_at, reverse=True)[:DASHBOARD_TOP_N],
+        "whole_market": whole_market,
+        "last_updated": {"watchlist": latest,
+                         "whole_market": {market: counts["last_updated"] for market, counts in whole_market.items()}},
+        "built_at": datetime.now(timezone.utc),
+    }
+
+class DashboardSnapshotStore:
+    def __init__(self):
+        self._current: Optional[Tuple[Tuple, bytes]] = None  # (数据版本, JSON 字节串)，整体替换引用
+        self._lock = threading.Lock()
+        self.last_build_seconds: Optional[float] = None
+
+    @staticmethod
+    def _data_version() -> Tuple:
+        return (get_data_version("stocks"), get_data_version("whole_market_stocks"))
+
+    def get(self) -> Tuple[Tuple, bytes]:
+        current = self._current
+        if current is not None and current[0] == self._data_version():
+            return current
+        return self.rebuild()
+
+    def rebuild(self) -> Tuple[Tuple, bytes]:
+        with self._lock:
+            version = self._data_version()  # 先取版本：构建期间发生的写入会让下一次读取重新构建
+            current = self._current
+            # 与 MarketSnapshotStore.get 相同，在锁内复查版本：并发读者排队等锁后直接复用已构建的快照
+            if current is not None and current[0] == version:
+                return current
+            started = time.perf_counter()
+            self._current = (version, dumps_json(build_dashboard_data()))
+            self.last_build_seconds = round(time.perf_counter() - started, 4)
+            return self._current
+
+dashboard_snapshot = DashboardSnapshotStore()
+
+async def refresh_dashboard_snapshot():
+    """刷新任务结束时调用；失败只记录日志，读取时会再惰性重建"""
+    try:
+        await run_in_threadpool(dashboard_snapshot.rebuild)
+    except Exception as e:
+        logging.error(f"重建仪表盘快照失败: {e}")
+
+@app.get("/stock_api/dashboard")
+async def get_dashboard(request: Request):
+    version, body = await run_in_threadpool(dashboard_snapshot.get)
+    return await serve_cached_json(request, "dashboard", {}, version, lambda: (body, {}))
+
 @app.post("/stock_api/update/trigger")
-async def trigger_update(background_tasks: BackgroundTasks):
+async def trigger_update(background_tasks: BackgroundTasks, mode: str = "full"):
+    # mode=quotes 只批量刷新行情；默认逐只刷新行情和基本面
+    if mode == "quotes":
+        background_tasks.add_task(update_watchlist_quotes_bulk)
+        return {"message": "自选股批量行情刷新任务已启动"}
     background_tasks.add_task(update_watchlist_stocks)
     return {"message": "数据更新任务已启动"}
 
 @app.get("/stock_api/full_market_update_status")
 async def get_full_market_update_status():
-    return full_market_update_status
+    return await run_in_threadpool(read_shared_job_status)
+
+@app.get("/stock_api/alerts/rules", response_model=List[AlertRuleResponse])
+async def list_alert_rules(symbol: Optional[str] = None, db: Session = Depends(get_db)):
+    query = db.query(AlertRule)
+    if symbol:
+        query = query.filter(AlertRule.symbol == symbol)
+    return await run_in_threadpool(lambda: query.order_by(AlertRule.id).all())
+
+@app.post("/stock_api/alerts/rules", response_model=AlertRuleResponse)
+async def create_alert_rule(rule: AlertRuleCreate, db: Session = Depends(get_db)):
+    if rule.kind not in ALERT_KINDS:
+        raise HTTPException(status_code=400, detail=f"不支持的提醒类型: {rule.kind}")
+    if rule.kind in ALERT_THRESHOLD_KINDS and rule.threshold is None:
+        raise HTTPException(status_code=400, detail="该提醒类型需要设置 threshold")
+    db_rule = AlertRule(symbol=rule.symbol, market=rule.market, kind=rule.kind,
+                        threshold=rule.threshold if rule.kind in ALERT_THRESHOLD_KINDS else None)
+    await run_in_threadpool(lambda: db.add(db_rule))
+    await run_in_threadpool(lambda: db.commit())
+    await run_in_threadpool(lambda: db.refresh(db_rule))
+    await run_in_threadpool(bump_data_version, "alert_rules")
+    return db_rule
+
+@app.delete("/stock_api/alerts/rules/{rule_id}")
+async def delete_alert_rule(rule_id: int, db: Session = Depends(get_db)):
+    db_rule = await run_in_threadpool(lambda: db.query(AlertRule).filter(AlertRule.id == rule_id).first())
+    if not db_rule:
+        raise HTTPException(status_code=404, detail="提醒规则不存在")
+    await run_in_threadpool(lambda: db.delete(db_rule))
+    await run_in_threadpool(lambda: db.commit())
+    await run_in_threadpool(bump_data_version, "alert_rules")
+    return {"message": "删除成功"}
+
+# 提醒事件与评估指标保存在执行刷新任务的 worker 进程内存中（定时任务只在调度 leader 上运行），
+# 多 worker 部署时不同 worker 返回的数据不同；需要完整事件流时配置 ALERT_WEBHOOK_URL
+@app.get("/stock_api/alerts/events")
+async def list_alert_events(limit: int = Query(100, ge=1, le=ALERT_EVENTS_BUFFER_SIZE)):
+    return list(alert_engine.events)[-limit:][::-1]
+
+@app.get("/stock_api/alerts/metrics")
+async def get_alert_metrics():
+    return alert_engine.status()
+
+@app.get("/stock_api/providers/status")
+async def get_providers_status():
+    return {
+        **quote_router.status(),
+        "circuit_breakers": {name: breaker.status() for name, breaker in list(circuit_breakers.items())},
+        "retry_budget": retry_budget.status(),
+        "http_pool": shared_http.status(),
+    }
+
+@app.get("/stock_api/job_status")
+async def get_background_job_status():
+    return await run_in_threadpool(read_shared_job_status, background_job_status)
+
+@app.get("/stock_api/maintenance/status")
+async def get_maintenance_status():
+    def read_status():
+        with engine.connect() as conn:
+            return {**database_stats(conn), "query_plans": check_query_plans(conn),
+                    "last_run": read_shared_job_status(background_job_status)["db_maintenance"]}
+    return await run_in_threadpool(read_status)
+
+@app.post("/stock_api/maintenance/trigger")
+async def trigger_maintenance(background_tasks: BackgroundTasks):
+    background_tasks.add_task(run_database_maintenance_job)
+    return {"message": "数据库维护任务已启动，结果见 /stock_api/maintenance/status"}
+
+@app.get("/stock_api/profiles", dependencies=[Depends(require_admin)])
+async def list_request_profiles(limit: int = Query(20, ge=1, le=PROFILE_BUFFER_SIZE)):
+    profiles = list(profile_buffer)[-limit:][::-1]
+    return [{key: value for key, value in profile.to_dict().items() if key != "statements"} for profile in profiles]
+
+@app.get("/stock_api/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_request_profile(profile_id: str):
+    for profile in profile_buffer:
+        if profile.id == profile_id:
+            return profile.to_dict()
+    raise HTTPException(status_code=404, detail="剖析记录不存在或已被淘汰")
+
+@app.get("/stock_api/scheduler/status")
+async def get_scheduler_status():
+    def read_lease():
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT owner, expires_at FROM scheduler_leases WHERE name = :name"),
+                                {"name": SCHEDULER_LEASE_NAME}).fetchone()
+    lease = await run_in_threadpool(read_lease)
+    return {
+        "worker_id": WORKER_ID,
+        "is_leader": scheduler_state["is_leader"],
+        "last_heartbeat": scheduler_state["last_heartbeat"],
+        "leader": lease[0] if lease else None,
+        "lease_expires_in": round(lease[1] - time.time(), 1) if lease else None,
+    }
 
 class MarketUpdateRequest(BaseModel):
     market: str
@@ -986,11 +3774,30 @@ async def manual_update(background_tasks: BackgroundTasks, db: Session = Depends
         background_tasks.add_task(update_stock_data_for_symbols, symbols, markets, SessionLocal())
     return {"message": f"已触发 {len(symbols)} 只自选股票的数据更新任务。"}
 
+@app.post("/stock_api/trigger_fundamentals_update")
+async def trigger_fundamentals_update(background_tasks: BackgroundTasks):
+    background_tasks.add_task(update_whole_market_fundamentals)
+    return {"message": "全市场基本面批量更新任务已启动，进度见 /stock_api/job_status"}
+
 @app.post("/stock_api/trigger_full_market_update")
 async def trigger_full_market_update(background_tasks: BackgroundTasks):
     background_tasks.add_task(update_full_market_data_overall)
     return {"message": "全市场股票数据更新任务已启动"}
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if scheduler_state["is_leader"]:
+        try:
+            release_lease(SCHEDULER_LEASE_NAME)
+        except Exception as e:
+            logging.warning(f"释放调度器租约失败: {e}")
+
+@app.get("/stock_api/startup_report")
+async def get_startup_report():
+    return startup_report
+
+startup_report["module_ready_seconds"] = round(time.perf_counter() - _module_import_started, 4)
+
 if __name__ == "__main__":
     import uvicorn
     import os
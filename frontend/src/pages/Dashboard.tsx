@@ -241,14 +241,12 @@ const Dashboard: React.FC = () => {
 
   const fetchDashboardData = async () => {
     try {
-      const [statsResponse, stocksResponse] = await Promise.all([
-        axios.get(`${API_BASE_URL}/analysis/screening`),
-        axios.get(`${API_BASE_URL}/stocks?skip=0&limit=10`)
-      ]);
-
-      setStats(statsResponse.data);
-      setRecentStocks(stocksResponse.data);
-      console.log("Dashboard data fetched:", statsResponse.data, stocksResponse.data); // Add log
+      // 仪表盘快照：统计数据和最近股票由后端预先计算，一次请求返回
+      const response = await axios.get(`${API_BASE_URL}/dashboard`);
+
+      setStats(response.data);
+      setRecentStocks(response.data.recent_stocks);
+      console.log("Dashboard data fetched:", response.data); // Add log
     } catch (error) {
       console.error('获取数据失败:', error);
     } finally {